@@ -0,0 +1,223 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+PAYLOAD_SIZES = [64, 1024, 64 * 1024, 1024 * 1024]  # Bytes per encrypt/decrypt call
+BATCH_SIZES = [100, 1000, 10000]  # Transactions per batch
+DIFFICULTIES = [1, 2, 3, 4]  # Leading hex zeros for the mining benchmark
+KEY = bytes(range(16))  # Fixed so every run does the same work
+REPEATS = 7  # Timed runs per benchmark; the median is reported
+COMPARABLE_META = ["machine", "cpus", "python", "pycryptodome"]  # Must match the baseline to compare
+
+
+# Benchmarks for the week4 AES helpers, Block hashing in every week and week1
+# mining. Results are saved as JSON and compared against a stored baseline;
+# a benchmark that got slower than the tolerance allows fails the run.
+# Usage: python benchmarks/bench.py [--quick] [--output FILE] [--save-baseline]
+
+def load_module(week, filename, name):
+    # Import one week's module by path; every week is its own flat project
+    directory = os.path.join(ROOT, week)
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(directory, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        sys.path.remove(directory)
+
+
+def measure(function, min_time, repeats=REPEATS, scale=1):
+    # Median calls per second (times scale, e.g. transactions or hashes per
+    # call) over several runs of at least min_time seconds each, and the
+    # interquartile range of those runs relative to the median, reported to
+    # show how noisy the benchmark was
+    rates = []
+    for _ in range(repeats):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        rates.append(calls / elapsed * scale)
+    median = statistics.median(rates)
+    lower, _, upper = statistics.quantiles(rates, n=4)
+    return {"ops_per_sec": median, "spread": (upper - lower) / median}
+
+
+def crypto_benchmarks(program, min_time, sizes, batch_sizes):
+    results = {}
+    modes = {
+        "cbc": (program.encrypt_cbc, program.decrypt_cbc),
+        "ctr": (program.encrypt_ctr, program.decrypt_ctr),
+        "ecb": (program.encrypt_ecb, program.decrypt_ecb),
+    }
+    for mode, (encrypt, decrypt) in modes.items():
+        for size in sizes:
+            data = "x" * size
+            encrypted = encrypt(data, KEY)
+            for operation, function in (("encrypt", lambda: encrypt(data, KEY)), ("decrypt", lambda: decrypt(encrypted, KEY))):
+                result = measure(function, min_time)
+                result["mb_per_sec"] = result["ops_per_sec"] * size / 1e6
+                results[f"aes.{mode}.{operation}.{size}"] = result
+    size = sizes[-1]
+    data = b"x" * size
+    result = measure(lambda: program.encrypt_ctr_parallel(data, KEY), min_time)
+    result["mb_per_sec"] = result["ops_per_sec"] * size / 1e6
+    results[f"aes.ctr_parallel.encrypt.{size}"] = result
+    for count in batch_sizes:
+        transactions = [f"Patient{i} pays Pharmacy {i % 97} BTC for prescription #{i}" for i in range(count)]
+        total = sum(len(tx) for tx in transactions)
+        for name, function in (("serial", lambda: [program.encrypt_ctr(tx, KEY) for tx in transactions]),
+                               ("batch", lambda: program.encrypt_ctr_batch(transactions, KEY))):
+            result = measure(function, min_time, scale=count)  # Transactions per second
+            result["mb_per_sec"] = result["ops_per_sec"] * total / count / 1e6
+            results[f"aes.ctr_{name}.transactions.{count}"] = result
+    chain = program.Blockchain()
+    chain.add_block(program.encrypt_cbc("Alice pays Bob 5 BTC", KEY))
+    view = program.DecryptedView(chain, KEY)
+    for name, function in (("uncached", lambda: program.decrypt_cbc(chain.chain[1].data, KEY)),
+                           ("cached", lambda: view.read(1, "cbc"))):
+        results[f"aes.view.read.{name}"] = measure(function, min_time)
+    return results
+
+
+def hash_benchmarks(week1, week2_block, week3, program, min_time):
+    transactions = [{"sender": f"user{i}", "receiver": f"user{i + 1}", "amount": i} for i in range(10)]
+    week1_block = week1.Block([f"Transaction {i}: Alice -> Bob: {i} BTC" for i in range(10)], 1, "0" * 64)
+    week2_legacy = week2_block.Block(1, transactions, 0.0, "0" * 64)
+    week2_merkle = week2_block.Block(1, transactions, 0.0, "0" * 64, merkle_root="ab" * 32)
+    week3_block = week3.Block(1, 0.0, {"action": "report", "patient_id": "patient1", "diagnostic": "diagnostic",
+                                       "report": "Blood test results are normal."}, "0" * 64, "diagnostic_node")
+    week4_block = program.Block(1, program.encrypt_cbc("Alice pays Bob 5 BTC", KEY), "0" * 64)
+    functions = {
+        "hash.week1.calculate_hash": week1_block.calculate_hash,
+        "hash.week2.compute_hash.legacy": week2_legacy.compute_hash,
+        "hash.week2.compute_hash.merkle": week2_merkle.compute_hash,
+        "hash.week3.calculate_hash": week3_block.calculate_hash,
+        "hash.week4.calculate_hash": week4_block.calculate_hash,
+    }
+    return {name: measure(function, min_time) for name, function in functions.items()}
+
+
+def mining_benchmarks(week1, difficulties, rounds, min_time):
+    # Hashes per second while mining the same fixed blocks over and over, so
+    # every call searches exactly the same nonces
+    blocks = []
+    for number in range(rounds):
+        block = week1.Block([f"Transaction {number}"], number, "0" * 64)
+        block.timestamp = 0.0
+        blocks.append(block)
+    results = {}
+    for difficulty in difficulties:
+        hashes = sum(block.mine_block(difficulty) for block in blocks)
+        results[f"mining.week1.difficulty.{difficulty}"] = measure(
+            lambda: [block.mine_block(difficulty) for block in blocks], min_time, scale=hashes)
+    return results
+
+
+def run(quick=False):
+    program = load_module("week4", "program.py", "week4_program")
+    week1 = load_module("week1", "p1.py", "week1_p1")
+    week2_block = load_module("week2", "block.py", "week2_block")
+    week3 = load_module("week3", "prog.py", "week3_prog")
+    min_time = 0.02 if quick else 0.15
+    results = {}
+    results.update(crypto_benchmarks(program, min_time, PAYLOAD_SIZES[:3] if quick else PAYLOAD_SIZES,
+                                     BATCH_SIZES[:2] if quick else BATCH_SIZES))
+    results.update(hash_benchmarks(week1, week2_block, week3, program, min_time))
+    results.update(mining_benchmarks(week1, DIFFICULTIES[:3] if quick else DIFFICULTIES, 3 if quick else 10, min_time))
+    import Crypto
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "pycryptodome": Crypto.__version__,
+            "quick": quick,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    # Names of the benchmarks whose median got slower than the tolerance
+    # allows. The spread of each run is shown, not used to widen the bound.
+    regressions = []
+    print(f"{'benchmark':<46}{'ops/s':>14}{'baseline':>14}{'change':>9}{'spread':>8}")
+    for name, result in current["results"].items():
+        ops = result["ops_per_sec"]
+        base_result = baseline["results"].get(name)
+        if base_result is None:
+            print(f"{name:<46}{ops:>14.1f}{'-':>14}{'new':>9}")
+            continue
+        base = base_result["ops_per_sec"]
+        spread = max(result.get("spread", 0.0), base_result.get("spread", 0.0))
+        change = ops / base - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<46}{ops:>14.1f}{base:>14.1f}{change:>+8.0%}{spread:>8.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AES, block hashing and mining across the weekly projects.")
+    parser.add_argument("--quick", action="store_true", help="smaller payloads and shorter runs")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.35,
+                        help="slowdown of the median allowed before a benchmark fails; unchanged code "
+                             "drifted by up to 33%% between runs on a one-CPU machine")
+    args = parser.parse_args()
+
+    current = run(args.quick)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(current, file, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline["meta"].get("quick") != current["meta"]["quick"]:
+        print("Baseline was recorded with a different --quick setting; rerun to match it before comparing")
+        sys.exit(2)
+    # Numbers from another host or software stack say nothing about this code
+    differences = [f"{key}: baseline {baseline['meta'].get(key)!r}, now {current['meta'][key]!r}"
+                   for key in COMPARABLE_META if baseline["meta"].get(key) != current["meta"][key]]
+    if differences:
+        print("Baseline was recorded in a different environment; record one here with --save-baseline")
+        for difference in differences:
+            print(f"  {difference}")
+        sys.exit(2)
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,157 @@
 import hashlib
+import multiprocessing
+import os
 import time
 
+# Number of nonces a mining worker tries between checks of the stop event
+STOP_CHECK_INTERVAL = 10000
+
+# A SHA-256 hex digest has 64 digits, so no hash can have more leading zeros
+MAX_DIFFICULTY = 64
+
+# Event shared by the mining pool so all workers stop once one finds a hash
+_stop_event = None
+
+
+def _init_miner(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+# Smallest digest that does NOT meet the difficulty, as raw bytes; a digest
+# has 'difficulty' leading hex zeros exactly when it sorts below this bound
+def difficulty_bound(difficulty):
+    if difficulty > MAX_DIFFICULTY:
+        raise ValueError(f"difficulty must be at most {MAX_DIFFICULTY}, got {difficulty}")
+    if difficulty <= 0:
+        return b'\xff' * 33  # Longer than any digest, so every digest sorts below it
+    return (1 << (256 - 4 * difficulty)).to_bytes(33, 'big')[1:]
+
+
+# Hash engine for mining: the fixed part of the block is hashed once and each
+# nonce attempt only feeds the nonce bytes into a copy of that midstate
+class MiningHasher:
+    def __init__(self, prefix):
+        self.midstate = hashlib.sha256(prefix)
+
+    def digest(self, nonce):
+        h = self.midstate.copy()
+        h.update(str(nonce).encode())
+        return h.digest()
+
+
+# Mining worker: tries nonces start, start + step, start + 2 * step, ... until
+# it finds a valid hash or another worker sets the stop event
+def _search_nonces(args):
+    prefix, bound, start, step = args
+    hasher = MiningHasher(prefix)
+    nonce = start
+    hashes = 0
+    while not _stop_event.is_set():
+        for _ in range(STOP_CHECK_INTERVAL):
+            digest = hasher.digest(nonce)
+            hashes += 1
+            if digest < bound:
+                _stop_event.set()
+                return nonce, digest.hex(), hashes
+            nonce += step
+    return None, None, hashes
+
+
+# Process pool that stays up across blocks, so mining a block does not pay
+# for starting (and on spawn platforms re-importing) the workers each time
+class MiningPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.stop_event = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(workers, initializer=_init_miner, initargs=(self.stop_event,))
+
+    # Search for a nonce on every worker; map returns once all have stopped,
+    # so the event can be cleared for the next block
+    def search(self, prefix, bound):
+        self.stop_event.clear()
+        tasks = [(prefix, bound, start, self.workers) for start in range(self.workers)]
+        return self.pool.map(_search_nonces, tasks)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 # Define the Block class
 class Block:
+    # Fixed attribute slots instead of a per-block __dict__ keep long chains compact
+    __slots__ = ('block_number', 'previous_hash', 'timestamp', 'nonce', 'block_data', 'hash')
+
     def __init__(self, block_data, block_number, previous_hash=''):
         self.block_number = block_number  # Block number (index in the chain)
-        self.header = f"Block #{self.block_number}"  # Block header now shows the block number
         self.previous_hash = previous_hash  # Previous block's hash
         self.timestamp = time.time()  # Unix timestamp
         self.nonce = 0  # Nonce for mining (Proof of Work)
         self.block_data = block_data  # List of transactions or data
         self.hash = self.calculate_hash()  # Hash of the current block (calculated)
-        self.next_block = None  # Link to the next block in the chain (initially None)
+
+    # Block header shows the block number; derived rather than stored per block
+    @property
+    def header(self):
+        return f"Block #{self.block_number}"
+
+    # Serialize everything except the nonce; the nonce goes last so miners can
+    # reuse the hash state of this prefix for every attempt
+    def hash_prefix(self):
+        return (str(self.block_number) +
+                str(self.header) +
+                str(self.previous_hash) +
+                str(self.timestamp) +
+                str(self.block_data)).encode()
 
     # Method to calculate hash of the block using sha256 from hashlib
     def calculate_hash(self):
         try:
-            # Manually concatenate the block's data into a single string
-            block_content = (str(self.block_number) + 
-                             str(self.header) + 
-                             str(self.previous_hash) + 
-                             str(self.timestamp) + 
-                             str(self.nonce) + 
-                             str(self.block_data))
-            # Return the SHA-256 hash of the concatenated string
-            return hashlib.sha256(block_content.encode()).hexdigest()
+            # Fixed block content followed by the nonce
+            block_content = self.hash_prefix() + str(self.nonce).encode()
+            # Return the SHA-256 hash of the concatenated content
+            return hashlib.sha256(block_content).hexdigest()
         except Exception as e:
             raise RuntimeError("Error calculating hash") from e
 
     # Proof of Work to find a valid hash (with leading zeros)
-    def mine_block(self, difficulty):
-        target = '0' * difficulty  # Target hash should start with 'difficulty' number of 0s
-        while not self.hash.startswith(target):
-            self.nonce += 1  # Increment nonce to try and change the hash
-            self.hash = self.calculate_hash()  # Recalculate hash with the new nonce
+    # Returns the number of hashes computed so callers can report a hash rate
+    def mine_block(self, difficulty, workers=1, pool=None):
+        if pool is not None or workers > 1:
+            return self.mine_block_parallel(difficulty, workers, pool)
+        bound = difficulty_bound(difficulty)  # Digest must have 'difficulty' leading hex zeros
+        hasher = MiningHasher(self.hash_prefix())
+        nonce = 0
+        digest = hasher.digest(nonce)
+        while not digest < bound:
+            nonce += 1  # Increment nonce to try and change the hash
+            digest = hasher.digest(nonce)
+        self.nonce = nonce
+        self.hash = digest.hex()
+        return nonce + 1
+
+    # Proof of Work split across a process pool, each worker searching its own
+    # interleaved slice of the nonce range. Without a pool a temporary one is
+    # started for this block only.
+    def mine_block_parallel(self, difficulty, workers, pool=None):
+        bound = difficulty_bound(difficulty)
+        prefix = self.hash_prefix()
+        if pool is not None:
+            results = pool.search(prefix, bound)
+        else:
+            with MiningPool(workers) as temporary:
+                results = temporary.search(prefix, bound)
+        # Several workers can finish in the same round; keep the smallest nonce
+        found = [(nonce, block_hash) for nonce, block_hash, _ in results if block_hash is not None]
+        self.nonce, self.hash = min(found)
+        return sum(worker_hashes for _, _, worker_hashes in results)
 
     def __str__(self):
         return (f"{self.header}\n"
@@ -44,45 +162,130 @@ class Block:
                 f"Block Data: {self.block_data}\n")
 
 
+# Chain container with O(1) lookup by block number and by hash
+class ChainIndex:
+    def __init__(self):
+        self.blocks = []  # Blocks in chain order
+        self.by_hash = {}  # Block hash -> position in self.blocks
+
+    def append(self, block):
+        self.by_hash[block.hash] = len(self.blocks)
+        self.blocks.append(block)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    # Position of a block number in the list; numbers are consecutive from the first block
+    def _position(self, block_number):
+        if not self.blocks:
+            return -1
+        return block_number - self.blocks[0].block_number
+
+    def get_by_number(self, block_number):
+        position = self._position(block_number)
+        if 0 <= position < len(self.blocks):
+            return self.blocks[position]
+        return None
+
+    def get_by_hash(self, block_hash):
+        position = self.by_hash.get(block_hash)
+        return self.blocks[position] if position is not None else None
+
+    # Iterate over blocks numbered start up to (but not including) stop
+    def range(self, start, stop=None):
+        first = max(self._position(start), 0)
+        last = len(self.blocks) if stop is None else max(self._position(stop), 0)
+        for position in range(first, min(last, len(self.blocks))):
+            yield self.blocks[position]
+
+
 # Define the Blockchain class
 class Blockchain:
-    def __init__(self, difficulty=2):
-        self.head = None  # Initially, no blocks are present
-        self.tail = None  # Initially, no blocks are present
+    # workers > 1 mines each block on a process pool of that size; None uses every core.
+    # The pool is started with the first block and kept until close().
+    def __init__(self, difficulty=2, workers=1):
+        if not 0 <= difficulty <= MAX_DIFFICULTY:
+            raise ValueError(f"difficulty must be between 0 and {MAX_DIFFICULTY}, got {difficulty}")
+        self.blocks = ChainIndex()  # Indexed storage for the chain
         self.difficulty = difficulty  # Difficulty level for mining (Proof of Work)
         self.block_number = 0  # Start with block number 0
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.hash_rate = 0.0  # Hashes per second achieved while mining the last block
+        self.pool = None  # MiningPool shared by every block when workers > 1
+
+    # Stop the mining pool's worker processes
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # First block in the chain (None while the chain is empty)
+    @property
+    def head(self):
+        return self.blocks.blocks[0] if self.blocks else None
+
+    # Last block in the chain (None while the chain is empty)
+    @property
+    def tail(self):
+        return self.blocks.blocks[-1] if self.blocks else None
+
+    # Mine a block and record the hash rate achieved
+    def mine(self, block):
+        if self.workers > 1 and self.pool is None:
+            self.pool = MiningPool(self.workers)
+        start = time.perf_counter()
+        hashes = block.mine_block(self.difficulty, self.workers, self.pool)
+        elapsed = time.perf_counter() - start
+        self.hash_rate = hashes / elapsed if elapsed > 0 else float(hashes)
 
     # Add a block to the blockchain
     def add_block(self, block_data):
         self.block_number += 1  # Increment block number for each new block
-        if self.head is None:
+        if self.tail is None:
             # First block (genesis block)
             new_block = Block(block_data, self.block_number)
-            new_block.mine_block(self.difficulty)  # Mine the block to find a valid hash
-            self.head = new_block
-            self.tail = new_block
         else:
-            # Add new block to the chain
+            # New block linked to the current tail by its hash
             new_block = Block(block_data, self.block_number, self.tail.hash)
-            new_block.mine_block(self.difficulty)  # Mine the block to find a valid hash
-            self.tail.next_block = new_block  # Link the previous block to the new one
-            self.tail = new_block  # Update the tail to the new block
+        self.mine(new_block)  # Mine the block to find a valid hash
+        self.blocks.append(new_block)
+
+    def get_block(self, block_number):
+        return self.blocks.get_by_number(block_number)
+
+    def get_block_by_hash(self, block_hash):
+        return self.blocks.get_by_hash(block_hash)
 
     # Display the entire blockchain
     def display_chain(self):
-        current_block = self.head
-        while current_block:
-            print(current_block)
-            current_block = current_block.next_block
+        for block in self.blocks:
+            print(block)
 
 
-# Example usage
-blockchain = Blockchain(difficulty=2)
+# Example usage (guarded so mining worker processes can import this module)
+if __name__ == "__main__":
+    blockchain = Blockchain(difficulty=2)
 
-# Adding blocks with some transaction data (could be any data, here using strings as placeholders)
-blockchain.add_block(["Transaction 1: Alice -> Bob: 10 BTC", "Transaction 2: Bob -> Charlie: 5 BTC"])
-blockchain.add_block(["Transaction 3: Charlie -> Alice: 2 BTC"])
-blockchain.add_block(["Transaction 4: Bob -> Alice: 3 BTC"])
+    # Adding blocks with some transaction data (could be any data, here using strings as placeholders)
+    blockchain.add_block(["Transaction 1: Alice -> Bob: 10 BTC", "Transaction 2: Bob -> Charlie: 5 BTC"])
+    blockchain.add_block(["Transaction 3: Charlie -> Alice: 2 BTC"])
+    blockchain.add_block(["Transaction 4: Bob -> Alice: 3 BTC"])
+
+    # Display the entire blockchain
+    blockchain.display_chain()
 
-# Display the entire blockchain
-blockchain.display_chain()
+    # Mine one more block in parallel mode on every available core
+    with Blockchain(difficulty=4, workers=None) as parallel_chain:
+        parallel_chain.add_block(["Transaction 5: Alice -> Charlie: 1 BTC"])
+        parallel_chain.add_block(["Transaction 6: Charlie -> Bob: 4 BTC"])
+        print(parallel_chain.tail)
+        print(f"Mined with {parallel_chain.workers} worker(s) at {parallel_chain.hash_rate:.0f} hashes/sec")
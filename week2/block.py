@@ -0,0 +1,72 @@
+import json
+from hashlib import sha256
+
+from merkle import merkle_root_error
+
+
+# Define a Block class that holds transactions and metadata.
+class Block:
+    def __init__(self, index, transactions, timestamp, previous_hash, nonce=0, hash=None, merkle_root=None):
+        self.index = index
+        self.transactions = transactions
+        self.timestamp = timestamp
+        self.previous_hash = previous_hash
+        self.nonce = nonce
+        self.hash = hash  # Cached hash of the content below, stored with the block
+        self.merkle_root = merkle_root  # Root of the Merkle tree over the transactions
+
+    def content(self):
+        # The fields covered by the block hash. The block commits to its
+        # transactions through the Merkle root, so a light client can check a
+        # single transaction with a proof and this header alone.
+        if self.merkle_root is not None:
+            return {
+                "index": self.index,
+                "merkle_root": self.merkle_root,
+                "timestamp": self.timestamp,
+                "previous_hash": self.previous_hash,
+                "nonce": self.nonce,
+            }
+        # Blocks stored before Merkle roots were added hash the full transaction list.
+        return {
+            "index": self.index,
+            "transactions": self.transactions,
+            "timestamp": self.timestamp,
+            "previous_hash": self.previous_hash,
+            "nonce": self.nonce,
+        }
+
+    def compute_hash(self):
+        # Create a SHA-256 hash of the block's content.
+        block_string = json.dumps(self.content(), sort_keys=True)
+        return sha256(block_string.encode()).hexdigest()
+
+    def legacy_link_hash(self):
+        # The original code linked block 1 to the hash of the genesis block's
+        # whole __dict__, which by then also held the genesis hash. Returns
+        # that hash for a legacy genesis block, otherwise None.
+        if self.index != 0 or self.merkle_root is not None:
+            return None
+        block_string = json.dumps({**self.content(), "hash": self.hash}, sort_keys=True)
+        return sha256(block_string.encode()).hexdigest()
+
+    def merkle_error(self):
+        # The hash only covers the Merkle root, so the transactions are only
+        # trustworthy once the root is recomputed from them. Returns why they
+        # do not match, or None.
+        if self.merkle_root is None:
+            return None  # Legacy blocks hash the transactions directly
+        return merkle_root_error(self.transactions, self.merkle_root)
+
+def block_from_dict(block_data, check_merkle=True):
+    # Rebuild a Block from its stored form. Older records carry no hash, so it
+    # is computed once here and cached on the block. Raises ValueError if the
+    # stored transactions do not match the block's Merkle root, unless the
+    # caller checks that itself.
+    block = Block(**block_data)
+    if block.hash is None:
+        block.hash = block.compute_hash()
+    reason = block.merkle_error() if check_merkle else None
+    if reason is not None:
+        raise ValueError(f"Block {block.index}: {reason}")
+    return block
@@ -0,0 +1,148 @@
+import json
+import os
+import queue
+import threading
+from array import array
+from collections import OrderedDict
+
+
+# Snapshot of the chain as of block N: the tip, the block count, where block N
+# ends in the log and the derived index state. The start offset of every
+# block is kept in a binary sidecar file so earlier blocks can be read lazily.
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.offsets_path = path + ".offsets"
+
+    def save(self, block_count, tip_hash, log_offset, offsets, state):
+        # Write both files to temporary names first so a crash never leaves a
+        # half-written checkpoint behind.
+        with open(self.offsets_path + ".tmp", "wb") as file:
+            offsets[:block_count].tofile(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.offsets_path + ".tmp", self.offsets_path)
+        checkpoint = {
+            "block_count": block_count,
+            "tip_hash": tip_hash,
+            "log_offset": log_offset,
+            "state": state,
+        }
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(checkpoint, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    def load(self):
+        # Returns the checkpoint with its offsets, or None if there is no usable one.
+        if not os.path.exists(self.path) or not os.path.exists(self.offsets_path):
+            return None
+        try:
+            with open(self.path, "r") as file:
+                checkpoint = json.load(file)
+            offsets = array("Q")
+            with open(self.offsets_path, "rb") as file:
+                offsets.frombytes(file.read())
+        except (ValueError, OSError):
+            return None
+        if len(offsets) < checkpoint["block_count"]:
+            return None
+        checkpoint["offsets"] = offsets[:checkpoint["block_count"]]
+        return checkpoint
+
+
+# Writes checkpoints on a background thread so adding a block never waits for
+# the index to be serialized and fsynced. The writer keeps its own copy of the
+# derived state, brought up to date from the blocks each checkpoint adds, so
+# nothing is copied while the chain lock is held.
+class CheckpointWriter:
+    def __init__(self, checkpoint, block_count, offsets, load_state):
+        self.checkpoint = checkpoint
+        self.block_count = block_count  # Blocks covered by the writer's state
+        self.offsets = offsets  # Start offset of each of those blocks in the log
+        self.load_state = load_state  # Returns the state as of block_count; called on the writer thread
+        self.state = None
+        self.error = None  # Why the writer stopped checkpointing, if it did
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, blocks, offsets, log_offset, tip_hash):
+        # Checkpoint the chain extended by blocks, which start at the given log
+        # offsets; log_offset is where the last of them ends
+        self.queue.put((blocks, offsets, log_offset, tip_hash))
+
+    def flush(self):
+        # Wait until every submitted checkpoint is written
+        self.queue.join()
+
+    def _run(self):
+        # Nothing may end this loop, or flush() would wait forever. A failed
+        # save only skips that checkpoint; anything else leaves the writer's
+        # state in doubt, so it stops checkpointing and the last good
+        # checkpoint on disk stays in place.
+        try:
+            self.state = self.load_state()
+        except Exception as e:
+            self._stop(e)
+        while True:
+            blocks, offsets, log_offset, tip_hash = self.queue.get()
+            try:
+                if self.error is None:
+                    for block in blocks:
+                        self.state.add_block(block)
+                    self.offsets.extend(offsets)
+                    self.block_count += len(blocks)
+                    self.checkpoint.save(self.block_count, tip_hash, log_offset, self.offsets, self.state.to_state())
+            except OSError as e:
+                print(f"Checkpoint at block {self.block_count} failed: {e}")
+            except Exception as e:
+                self._stop(e)
+            finally:
+                self.queue.task_done()
+
+    def _stop(self, error):
+        self.error = error
+        print(f"Checkpoint writer stopped at block {self.block_count}: {error!r}")
+
+
+# List-like chain whose first base_count blocks stay on disk and are loaded on
+# demand (with a bounded cache); blocks after that are held in memory.
+class LazyChain:
+    def __init__(self, base_count=0, load_block=None, cache_size=10000):
+        self.base_count = base_count
+        self.load_block = load_block  # Loads block i < base_count from storage
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()  # Request threads share the cache
+        self.blocks = []  # Blocks after the checkpoint
+
+    def __len__(self):
+        return self.base_count + len(self.blocks)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("block index out of range")
+        if position >= self.base_count:
+            return self.blocks[position - self.base_count]
+        with self.cache_lock:
+            block = self.cache.get(position)
+            if block is not None:
+                self.cache.move_to_end(position)
+                return block
+        block = self.load_block(position)
+        with self.cache_lock:
+            self.cache[position] = block
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return block
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def append(self, block):
+        self.blocks.append(block)
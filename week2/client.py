@@ -1,30 +1,124 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 import requests
+from requests.adapters import HTTPAdapter
 
 # The server address (adjust if needed)
 server_address = "http://127.0.0.1:5000"
 
-def create_transaction(sender, receiver, amount):
+# Keep-alive sessions, one per thread, so requests reuse pooled connections.
+_local = threading.local()
+
+def get_session(pool_size=10):
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+def create_transaction(sender, receiver, amount, nonce=None):
+    # Pass the same nonce to retry a transaction without paying twice
     tx_data = {
         "sender": sender,
         "receiver": receiver,
-        "amount": amount
+        "amount": amount,
+        "nonce": nonce or uuid.uuid4().hex
     }
-    response = requests.post(f"{server_address}/new_transaction", json=tx_data)
+    response = get_session().post(f"{server_address}/new_transaction", json=tx_data)
     print("Transaction response:", response.text)
 
-def mine_block():
-    response = requests.get(f"{server_address}/mine")
-    print("Mining response:", response.text)
-
-def get_blockchain():
-    response = requests.get(f"{server_address}/chain")
-    if response.status_code == 200:
-        chain = response.json()
-        print("Current Blockchain Ledger:")
-        for block in chain:
-            print(f"Block #{block['index']} - Hash: {block['previous_hash']} - Nonce: {block['nonce']}")
+def submit_batch(transactions):
+    # Send one batch to /new_transactions and return its per-item results.
+    response = get_session().post(f"{server_address}/new_transactions", json=transactions)
+    response.raise_for_status()
+    return response.json()["results"]
+
+def create_transactions(transactions, batch_size=500, senders=1):
+    # Submit many transactions in batches, optionally from several concurrent
+    # senders. Returns the per-item results in the order given.
+    batches = [transactions[i:i + batch_size] for i in range(0, len(transactions), batch_size)]
+    if senders <= 1:
+        results = [submit_batch(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=senders) as executor:
+            results = list(executor.map(submit_batch, batches))
+    results = [result for batch_results in results for result in batch_results]
+    accepted = sum(1 for result in results if result["status"] == "added")
+    print(f"Submitted {len(transactions)} transaction(s), {accepted} accepted.")
+    return results
+
+def mine_block(poll_interval=0.5):
+    # Mining runs as a background job on the node; poll until it finishes.
+    response = get_session().get(f"{server_address}/mine")
+    job = response.json()
+    print("Mining job queued:", job["job_id"])
+    while job["status"] in ("queued", "mining"):
+        time.sleep(poll_interval)
+        job = get_session().get(f"{server_address}/mine/{job['job_id']}").json()
+    print("Mining response:", job["message"], f"({job['hash_rate']:.0f} hashes/sec)")
+    return job
+
+# Blocks fetched so far and the ETag of the last /chain response, so repeated
+# calls only download blocks that are new since the previous call.
+local_chain = []
+chain_etag = None
+chain_etag_params = None  # Query the ETag belongs to; it only applies to the same range
+
+def get_blockchain(page_size=None):
+    global chain_etag, chain_etag_params
+    params = {"from": len(local_chain)}
+    if page_size is not None:
+        params["limit"] = page_size
+    headers = {"If-None-Match": chain_etag} if chain_etag and chain_etag_params == params else {}
+    response = get_session().get(f"{server_address}/chain", params=params, headers=headers)
+    if response.status_code == 304:
+        print("Blockchain unchanged since last fetch.")
+    elif response.status_code == 200:
+        new_blocks = response.json()
+        local_chain.extend(new_blocks)
+        chain_etag = response.headers.get("ETag")
+        chain_etag_params = params
+        print(f"Fetched {len(new_blocks)} new block(s).")
     else:
         print("Error fetching blockchain:", response.text)
+        return local_chain
+    print("Current Blockchain Ledger:")
+    for block in local_chain:
+        print(f"Block #{block['index']} - Hash: {block['previous_hash']} - Nonce: {block['nonce']}")
+    return local_chain
+
+def verify_inclusion_proof(proof_response, transaction=None):
+    # Check a /proof response: fold the sibling path into the Merkle root, then
+    # check the header (which commits to that root) hashes to the block hash.
+    # If the transaction itself is given, its id is recomputed as well.
+    tx_id = proof_response["tx_id"]
+    if transaction is not None and sha256(json.dumps(transaction, sort_keys=True).encode()).hexdigest() != tx_id:
+        return False
+    node = bytes.fromhex(tx_id)
+    for step in proof_response["proof"]:
+        sibling = bytes.fromhex(step["hash"])
+        node = sha256(sibling + node if step["side"] == "left" else node + sibling).digest()
+    header = proof_response["header"]
+    if node.hex() != header["merkle_root"]:
+        return False
+    return sha256(json.dumps(header, sort_keys=True).encode()).hexdigest() == proof_response["block_hash"]
+
+def get_inclusion_proof(block_index, tx):
+    # Fetch and verify the proof that a transaction (id or position) is in a block.
+    response = get_session().get(f"{server_address}/proof/{block_index}/{tx}")
+    if response.status_code != 200:
+        print("Error fetching proof:", response.text)
+        return False
+    valid = verify_inclusion_proof(response.json())
+    print(f"Transaction {response.json()['tx_id']} in block #{block_index}:", "verified" if valid else "INVALID proof")
+    return valid
 
 if __name__ == "__main__":
     # Example usage: create a transaction, mine it, and then display the ledger.
@@ -0,0 +1,102 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+# Every record is a fixed header (payload length, CRC-32 of the payload)
+# followed by the block serialized as compact JSON.
+RECORD_HEADER = struct.Struct("<II")
+
+
+# Append-only block storage: one checksummed record per block.
+class LedgerLog:
+    def __init__(self, path, sync_every=1):
+        self.path = path
+        self.sync_every = sync_every  # fsync after this many appends (0 = leave it to the OS)
+        self.file = None
+        self.reader = None  # Separate handle for reading single records
+        self.read_lock = threading.Lock()
+        self.offsets = array("Q")  # Byte offset where each record starts
+        self.end_offset = 0  # Byte offset just past the last valid record
+        self.unsynced = 0  # Appends written since the last fsync
+        self.recovered = False
+
+    @property
+    def records(self):
+        # Number of valid records in the log
+        return len(self.offsets)
+
+    def exists(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def replay(self, offset=0, offsets=None):
+        # Yield every stored record from the given byte offset on. When starting
+        # past the beginning, offsets must hold the start of each earlier record.
+        # A torn or corrupt record can only come from a crash during the last
+        # append, so the log is truncated there.
+        self.offsets = array("Q", offsets or [])
+        self.end_offset = offset
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as file:
+                file.seek(offset)
+                while True:
+                    header = file.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    length, checksum = RECORD_HEADER.unpack(header)
+                    payload = file.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != checksum:
+                        break
+                    self.offsets.append(self.end_offset)
+                    self.end_offset = file.tell()
+                    yield json.loads(payload)
+            if self.end_offset < os.path.getsize(self.path):
+                with open(self.path, "r+b") as file:
+                    file.truncate(self.end_offset)
+        self.recovered = True
+
+    def read(self, position):
+        # Read a single record by its position in the log.
+        offset = self.offsets[position]
+        with self.read_lock:
+            if self.reader is None:
+                self.reader = open(self.path, "rb")
+            self.reader.seek(offset)
+            length, checksum = RECORD_HEADER.unpack(self.reader.read(RECORD_HEADER.size))
+            payload = self.reader.read(length)
+        if zlib.crc32(payload) != checksum:
+            raise ValueError(f"Corrupt ledger record at offset {offset}")
+        return json.loads(payload)
+
+    def append(self, record):
+        if not self.recovered:
+            # Make sure a torn tail is cut off before writing after it
+            for _ in self.replay():
+                pass
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        payload = json.dumps(record, sort_keys=True, separators=(",", ":")).encode()
+        self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.offsets.append(self.end_offset)
+        self.end_offset += RECORD_HEADER.size + len(payload)
+        self.unsynced += 1
+        if self.sync_every and self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        # Flush buffered appends and force them to disk
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
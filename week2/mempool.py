@@ -0,0 +1,119 @@
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from hashlib import sha256
+
+
+def transaction_id(transaction):
+    # Transactions are identified by the hash of their canonical JSON form, so
+    # the same id can be derived again later from a mined block.
+    return sha256(json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+
+
+def with_nonce(transaction):
+    # The nonce makes the id unique per payment: a client that retries sends
+    # the same nonce and is caught as a duplicate, while paying the same
+    # amount again is a new transaction. Clients that send none get one here.
+    if "nonce" not in transaction:
+        transaction["nonce"] = uuid.uuid4().hex
+    return transaction
+
+
+# Bounded, thread-safe pool of transactions waiting to be mined.
+class Mempool:
+    eviction_policies = ("reject", "oldest")
+
+    def __init__(self, capacity=10000, eviction="reject", is_mined=None):
+        if eviction not in self.eviction_policies:
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.capacity = capacity
+        self.eviction = eviction  # "reject" refuses new transactions when full, "oldest" drops the oldest
+        self.is_mined = is_mined or (lambda tx_id: False)  # Whether a tx id is already on the chain
+        self.pending = OrderedDict()  # tx id -> (transaction, size), in arrival order
+        self.by_sender = {}  # sender -> OrderedDict of that sender's pending tx ids
+        self.taken = set()  # Ids taken for a block that is not committed yet
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, transaction):
+        # Returns (status, tx_id) where status is "added", "duplicate" or "full".
+        with self.lock:
+            return self._add(transaction)
+
+    def add_many(self, transactions):
+        # Add a batch under a single lock acquisition; one (status, tx_id) per item.
+        with self.lock:
+            return [self._add(transaction) for transaction in transactions]
+
+    def take_block(self, max_transactions=None, max_bytes=None):
+        # Remove and return transactions for the next block in arrival order,
+        # which keeps each sender's transactions in the order they were sent.
+        transactions = []
+        total_bytes = 0
+        with self.lock:
+            for tx_id, (transaction, size) in self.pending.items():
+                if max_transactions is not None and len(transactions) >= max_transactions:
+                    break
+                if max_bytes is not None and transactions and total_bytes + size > max_bytes:
+                    break
+                transactions.append((tx_id, transaction))
+                total_bytes += size
+            for tx_id, _ in transactions:
+                self._remove(tx_id)
+            # Only once every removal went through, so a failure leaves no
+            # id stuck in taken while its transaction is still pending
+            self.taken.update(tx_id for tx_id, _ in transactions)
+        return [transaction for _, transaction in transactions]
+
+    def confirm(self, transactions):
+        # The block holding these transactions was committed; from now on
+        # is_mined() reports them as duplicates.
+        with self.lock:
+            for transaction in transactions:
+                self.taken.discard(transaction_id(transaction))
+
+    def requeue(self, transactions):
+        # Put transactions from a block that failed to commit back at the front.
+        with self.lock:
+            for transaction in reversed(transactions):
+                tx_id = transaction_id(transaction)
+                self.taken.discard(tx_id)
+                if tx_id in self.pending:
+                    continue
+                size = len(json.dumps(transaction))
+                sender_ids = self.by_sender.setdefault(transaction.get("sender"), OrderedDict())
+                sender_ids[tx_id] = None
+                sender_ids.move_to_end(tx_id, last=False)
+                self.pending[tx_id] = (transaction, size)
+                self.pending.move_to_end(tx_id, last=False)
+
+    def pending_for(self, sender):
+        # Pending transactions from one sender, oldest first.
+        with self.lock:
+            return [self.pending[tx_id][0] for tx_id in self.by_sender.get(sender, ())]
+
+    def _add(self, transaction):
+        tx_id = transaction_id(transaction)
+        if tx_id in self.pending or tx_id in self.taken or self.is_mined(tx_id):
+            return "duplicate", tx_id
+        if len(self.pending) >= self.capacity:
+            if self.eviction == "reject":
+                return "full", tx_id
+            self._remove(next(iter(self.pending)))
+        # by_sender first: if the sender cannot be indexed, nothing was stored
+        size = len(json.dumps(transaction))
+        self.by_sender.setdefault(transaction.get("sender"), OrderedDict())[tx_id] = None
+        self.pending[tx_id] = (transaction, size)
+        return "added", tx_id
+
+    def _remove(self, tx_id):
+        transaction, _ = self.pending[tx_id]
+        sender = transaction.get("sender")
+        sender_ids = self.by_sender[sender]
+        del sender_ids[tx_id]
+        if not sender_ids:
+            del self.by_sender[sender]
+        del self.pending[tx_id]
@@ -0,0 +1,54 @@
+from hashlib import sha256
+
+from mempool import transaction_id
+
+
+def _hash_pair(left, right):
+    return sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def merkle_levels(transactions):
+    return merkle_levels_from_ids([transaction_id(transaction) for transaction in transactions])
+
+
+def merkle_levels_from_ids(tx_ids):
+    # Build the tree bottom-up from the transaction ids. A level with an odd
+    # number of nodes pairs its last node with itself, so [a, b, c] and
+    # [a, b, c, c] share a root; blocks with repeated ids are refused for that.
+    level = list(tx_ids)
+    if not level:
+        return [[sha256(b"").hexdigest()]]
+    levels = [level]
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + [level[-1]]
+        level = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def merkle_root(transactions):
+    return merkle_levels(transactions)[-1][0]
+
+
+def merkle_root_error(transactions, root):
+    # Why root is not the Merkle root of these transactions, or None
+    tx_ids = [transaction_id(transaction) for transaction in transactions]
+    if len(set(tx_ids)) != len(tx_ids):
+        return "block contains the same transaction more than once"
+    if merkle_levels_from_ids(tx_ids)[-1][0] != root:
+        return "merkle_root does not match the block's transactions"
+    return None
+
+
+def merkle_proof(transactions, position):
+    # Sibling hashes from the leaf at position up to the root, each tagged with
+    # the side it sits on.
+    proof = []
+    for level in merkle_levels(transactions)[:-1]:
+        sibling = position ^ 1
+        if sibling >= len(level):
+            sibling = position
+        proof.append({"hash": level[sibling], "side": "left" if sibling < position else "right"})
+        position //= 2
+    return proof
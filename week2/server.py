@@ -1,131 +1,495 @@
-from hashlib import sha256
+import atexit
 import json
 import time
 import os
-from flask import Flask, request, jsonify
-
-# Define a Block class that holds transactions and metadata.
-class Block:
-    def __init__(self, index, transactions, timestamp, previous_hash, nonce=0):
-        self.index = index
-        self.transactions = transactions
-        self.timestamp = timestamp
-        self.previous_hash = previous_hash
-        self.nonce = nonce
-
-    def compute_hash(self):
-        # Create a SHA-256 hash of the block's content.
-        block_string = json.dumps(self.__dict__, sort_keys=True)
-        return sha256(block_string.encode()).hexdigest()
+import queue
+import struct
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from flask import Flask, Response, request, jsonify
+from block import Block, block_from_dict
+from checkpoint import Checkpoint, CheckpointWriter, LazyChain
+from ledger_log import LedgerLog
+from mempool import Mempool, transaction_id, with_nonce
+from merkle import merkle_proof, merkle_root
+from tx_index import TransactionIndex
 
 # Define the Blockchain class that manages chain and mining.
 class Blockchain:
     difficulty = 2  # mining difficulty (leading zeros)
-    blockchain_file = "blockchain.json"  # File where blockchain is stored
+    blockchain_file = "blockchain.json"  # Legacy JSON ledger, migrated once into the log
+    ledger_file = "blockchain.log"  # Append-only log where blocks are stored
+    sync_every = 1  # fsync the log after this many blocks
+    checkpoint_file = "blockchain.checkpoint"  # Snapshot used to skip replaying the whole log
+    checkpoint_every = 1000  # Write a checkpoint after this many new blocks
+    mempool_capacity = 10000  # Pending transactions held before the eviction policy applies
+    mempool_eviction = "reject"  # "reject" new transactions or evict the "oldest" when full
+    max_block_transactions = 500  # Most transactions mined into one block
+    max_block_bytes = 1000000  # Most serialized transaction bytes mined into one block
 
     def __init__(self):
-        self.unconfirmed_transactions = []  # Transactions waiting to be mined
-        self.chain = []  # The actual blockchain
+        # Transactions waiting to be mined; anything already in the index is a duplicate
+        self.mempool = Mempool(self.mempool_capacity, self.mempool_eviction,
+                               is_mined=lambda tx_id: self.index.get_location(tx_id) is not None)
+        self.chain = LazyChain()  # The actual blockchain
+        self.lock = threading.RLock()  # Guards the chain
+        self.index = TransactionIndex()  # Transaction and address lookups over the chain
+        self.ledger = LedgerLog(self.ledger_file, sync_every=self.sync_every)
+        self.checkpoint = Checkpoint(self.checkpoint_file)
+        self.checkpointed_blocks = 0  # Block count covered by the latest checkpoint handed to the writer
         self.load_chain()
+        self.checkpoint_writer = CheckpointWriter(self.checkpoint, self.checkpointed_blocks,
+                                                  self.ledger.offsets[:self.checkpointed_blocks],
+                                                  self.load_checkpoint_state)
 
     def load_chain(self):
-        # Load the blockchain from a file, or create a new one if it doesn't exist.
-        if os.path.exists(self.blockchain_file):
-            with open(self.blockchain_file, 'r') as file:
-                blockchain_data = json.load(file)
-                for block_data in blockchain_data:
-                    block = Block(**block_data)
-                    self.chain.append(block)
+        # Restore the latest checkpoint and replay only the blocks after it, or
+        # replay the whole log, migrating the old JSON ledger on first start.
+        # A new chain is created if neither exists.
+        if not self.ledger.exists() and os.path.exists(self.blockchain_file):
+            self.migrate_json_ledger()
+        checkpoint = self.checkpoint.load()
+        if checkpoint is not None and self.restore_checkpoint(checkpoint):
+            records = self.ledger.replay(checkpoint["log_offset"], checkpoint["offsets"])
         else:
+            self.chain = LazyChain()
+            self.index = TransactionIndex()
+            records = self.ledger.replay()
+        for block_data in records:
+            block = block_from_dict(block_data)
+            self.chain.append(block)
+            self.index.add_block(block)
+        if not len(self.chain):
             self.create_genesis_block()
 
+    def restore_checkpoint(self, checkpoint):
+        # Adopt the checkpoint's state if it matches the log; earlier blocks are
+        # then read from the log only when something asks for them.
+        block_count = checkpoint["block_count"]
+        offsets = checkpoint["offsets"]
+        if block_count == 0 or not self.ledger.exists() or os.path.getsize(self.ledger_file) < checkpoint["log_offset"]:
+            return False
+        self.ledger.offsets = offsets
+        try:
+            tip_hash = block_from_dict(self.ledger.read(block_count - 1)).hash
+        except (ValueError, OSError, struct.error):
+            return False
+        if tip_hash != checkpoint["tip_hash"]:
+            return False
+        self.chain = LazyChain(block_count, lambda position: block_from_dict(self.ledger.read(position)))
+        self.index = TransactionIndex.from_state(checkpoint["state"])
+        self.checkpointed_blocks = block_count
+        return True
+
+    def load_checkpoint_state(self):
+        # The index as of the latest checkpoint, read again for the checkpoint
+        # writer's own copy
+        if not self.checkpointed_blocks:
+            return TransactionIndex()
+        return TransactionIndex.from_state(self.checkpoint.load()["state"])
+
+    def save_checkpoint(self, wait=False):
+        # Hand the blocks added since the last checkpoint to the checkpoint
+        # writer; called every checkpoint_every blocks. Only the log sync, so
+        # the checkpoint never points past durable records, happens here.
+        with self.lock:
+            block_count = len(self.chain)
+            if block_count > self.checkpointed_blocks:
+                self.ledger.sync()
+                start = self.checkpointed_blocks
+                self.checkpoint_writer.submit([self.chain[position] for position in range(start, block_count)],
+                                              self.ledger.offsets[start:block_count], self.ledger.end_offset,
+                                              self.last_block.hash)
+                self.checkpointed_blocks = block_count
+        if wait:
+            self.checkpoint_writer.flush()
+
+    def migrate_json_ledger(self):
+        # One-time import of blockchain.json into the append-only log.
+        with open(self.blockchain_file, 'r') as file:
+            blockchain_data = json.load(file)
+        for block_data in blockchain_data:
+            self.ledger.append(block_data)
+        self.ledger.sync()
+
     def create_genesis_block(self):
         # Create the first block with no transactions.
-        genesis_block = Block(0, [], time.time(), "0")
+        genesis_block = Block(0, [], time.time(), "0", merkle_root=merkle_root([]))
         genesis_block.hash = genesis_block.compute_hash()
         self.chain.append(genesis_block)
-        self.save_chain()
+        self.index.add_block(genesis_block)
+        self.save_block(genesis_block)
 
-    def save_chain(self):
-        # Save the blockchain to the file.
-        with open(self.blockchain_file, 'w') as file:
-            json.dump([block.__dict__ for block in self.chain], file, indent=4)
+    def save_block(self, block):
+        # Append a single block to the log; earlier records are never rewritten.
+        self.ledger.append(block.__dict__)
 
     @property
     def last_block(self):
         # Return the last block in the blockchain.
         return self.chain[-1]
 
-    def proof_of_work(self, block):
-        # Perform a simple proof-of-work algorithm.
+    def proof_of_work(self, block, job=None):
+        # Perform a simple proof-of-work algorithm, reporting progress to the job if given.
         block.nonce = 0
         computed_hash = block.compute_hash()
         while not computed_hash.startswith('0' * Blockchain.difficulty):
             block.nonce += 1
+            if job is not None and block.nonce % MiningJob.progress_interval == 0:
+                job.record_progress(block.nonce)
             computed_hash = block.compute_hash()
+        if job is not None:
+            job.record_progress(block.nonce + 1)
+        block.hash = computed_hash
         return computed_hash
 
     def add_block(self, block, proof):
-        # Validate the block's previous hash and the proof-of-work.
-        previous_hash = self.last_block.compute_hash()
-        if previous_hash != block.previous_hash:
-            return False
-        if not proof.startswith('0' * Blockchain.difficulty) or proof != block.compute_hash():
-            return False
-        self.chain.append(block)
-        self.save_chain()  # Save the blockchain after adding a new block
-        return True
+        # Validate the block's previous hash against the cached tip hash and the
+        # proof-of-work; earlier blocks are not rehashed.
+        with self.lock:
+            if self.last_block.hash != block.previous_hash:
+                return False
+            if not proof.startswith('0' * Blockchain.difficulty) or proof != block.compute_hash():
+                return False
+            if block.merkle_error() is not None:
+                return False
+            block.hash = proof
+            self.chain.append(block)
+            self.index.add_block(block)
+            self.save_block(block)  # Persist the new block
+            if len(self.chain) - self.checkpointed_blocks >= self.checkpoint_every:
+                self.save_checkpoint()
+            return True
+
+    def verify(self):
+        # Recompute every block hash and Merkle root and check each link and proof-of-work.
+        # Returns None for a valid chain, otherwise the first bad block and why.
+        with self.lock:
+            length = len(self.chain)
+        target = '0' * Blockchain.difficulty
+        previous_hash = None
+        legacy_hash = None  # Also accepted after a legacy genesis block, see Block.legacy_link_hash
+        for position in range(length):
+            try:
+                block = self.chain[position]
+            except ValueError as e:
+                return {"index": position, "reason": str(e)}  # Checkpointed block rejected on load
+            computed_hash = block.compute_hash()
+            if computed_hash != block.hash:
+                return {"index": block.index, "reason": "stored hash does not match block content"}
+            reason = block.merkle_error()
+            if reason is not None:
+                return {"index": block.index, "reason": reason}
+            if previous_hash is not None:
+                legacy_link = block.merkle_root is None and block.previous_hash == legacy_hash
+                if block.previous_hash != previous_hash and not legacy_link:
+                    return {"index": block.index, "reason": "previous_hash does not match the preceding block"}
+                if not computed_hash.startswith(target):
+                    return {"index": block.index, "reason": "hash does not meet the proof-of-work target"}
+            previous_hash = computed_hash
+            legacy_hash = block.legacy_link_hash()
+        return None
 
     def add_new_transaction(self, transaction):
-        # Add a new transaction to the unconfirmed transactions list.
-        self.unconfirmed_transactions.append(transaction)
+        # Add a new transaction to the mempool; returns (status, tx_id).
+        return self.mempool.add(with_nonce(transaction))
+
+    def add_new_transactions(self, transactions):
+        # Add a batch of transactions to the mempool; one (status, tx_id) per item.
+        return self.mempool.add_many([with_nonce(transaction) for transaction in transactions])
 
-    def mine(self):
-        # Mine unconfirmed transactions if available.
-        if not self.unconfirmed_transactions:
+    def mine(self, job=None):
+        # Mine unconfirmed transactions if available. The block's transactions are
+        # taken out of the mempool up front so anything arriving while the proof
+        # of work runs waits for the next block instead of being dropped.
+        transactions = self.mempool.take_block(self.max_block_transactions, self.max_block_bytes)
+        if not transactions:
             return False
-        last_block = self.last_block
+        with self.lock:
+            last_block = self.last_block
+            previous_hash = last_block.hash
         new_block = Block(
             index=last_block.index + 1,
-            transactions=self.unconfirmed_transactions,
+            transactions=transactions,
             timestamp=time.time(),
-            previous_hash=last_block.compute_hash()
+            previous_hash=previous_hash,
+            merkle_root=merkle_root(transactions)
         )
-        proof = self.proof_of_work(new_block)
-        self.add_block(new_block, proof)
-        self.unconfirmed_transactions = []  # Reset the transaction pool
+        proof = self.proof_of_work(new_block, job)
+        with self.lock:
+            if not self.add_block(new_block, proof):
+                # The tip moved while mining; put the transactions back in front.
+                self.mempool.requeue(transactions)
+                return False
+        self.mempool.confirm(transactions)
         return new_block.index
 
+# A mining request tracked by the background worker.
+class MiningJob:
+    progress_interval = 1000  # Nonces between progress updates
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"  # queued -> mining -> mined / no_transactions / failed
+        self.hashes = 0
+        self.hash_rate = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self.block_index = None
+        self.message = ""
+
+    def record_progress(self, hashes):
+        self.hashes = hashes
+        elapsed = time.time() - self.started_at
+        if elapsed > 0:
+            self.hash_rate = hashes / elapsed
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "hashes": self.hashes,
+            "hash_rate": self.hash_rate,
+            "block_index": self.block_index,
+            "message": self.message,
+        }
+
+# Background thread that runs queued mining jobs one at a time.
+class MiningWorker(threading.Thread):
+    max_jobs = 1000  # Finished jobs kept around for status queries
+
+    def __init__(self, blockchain):
+        threading.Thread.__init__(self, daemon=True)
+        self.blockchain = blockchain
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.jobs_lock = threading.Lock()
+
+    def submit(self):
+        job = MiningJob(uuid.uuid4().hex)
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self.queue.put(job)
+        return job
+
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            job.status = "mining"
+            job.started_at = time.time()
+            try:
+                result = self.blockchain.mine(job)
+                if result is False and job.hashes == 0:
+                    # Nothing was mined because the pool was empty
+                    job.status = "no_transactions"
+                    job.message = "No transactions to mine"
+                elif result is False:
+                    job.status = "failed"
+                    job.message = "Chain tip changed while mining; transactions returned to the pool"
+                else:
+                    job.status = "mined"
+                    job.block_index = result
+                    job.message = f"Block #{result} is mined."
+            except Exception as e:
+                job.status = "failed"
+                job.message = str(e)
+            finally:
+                job.finished_at = time.time()
+                self.queue.task_done()
+
 # Initialize the Flask application and our Blockchain instance.
 app = Flask(__name__)
 blockchain = Blockchain()
+atexit.register(blockchain.ledger.close)  # Flush any unsynced blocks on shutdown
+atexit.register(blockchain.save_checkpoint, wait=True)  # Runs first, so the next start skips the replay
+mining_worker = MiningWorker(blockchain)
+mining_worker.start()
+
+def is_valid_transaction(tx_data):
+    # "nonce" is optional; clients that retry send the same one each time
+    required_fields = ["sender", "receiver", "amount"]
+    return (isinstance(tx_data, dict) and all(field in tx_data for field in required_fields)
+            and isinstance(tx_data["sender"], str) and isinstance(tx_data["receiver"], str)
+            and isinstance(tx_data["amount"], (int, float)) and not isinstance(tx_data["amount"], bool)
+            and isinstance(tx_data.get("nonce", ""), str))
 
 # Endpoint to add a new transaction.
 @app.route('/new_transaction', methods=['POST'])
 def new_transaction():
     tx_data = request.get_json()
-    required_fields = ["sender", "receiver", "amount"]
-    if not all(field in tx_data for field in required_fields):
+    if not is_valid_transaction(tx_data):
         return "Invalid transaction data", 400
-    blockchain.add_new_transaction(tx_data)
-    return "Transaction added", 201
+    status, tx_id = blockchain.add_new_transaction(tx_data)
+    if status == "duplicate":
+        return jsonify({"message": "Duplicate transaction", "tx_id": tx_id}), 409
+    if status == "full":
+        return jsonify({"message": "Mempool is full", "tx_id": tx_id}), 503
+    return jsonify({"message": "Transaction added", "tx_id": tx_id}), 201
+
+# Endpoint to add many transactions in one request. The body is a JSON list of
+# transactions; the response has one result per item, in the same order.
+@app.route('/new_transactions', methods=['POST'])
+def new_transactions():
+    batch = request.get_json()
+    if not isinstance(batch, list):
+        return "Expected a JSON list of transactions", 400
+    valid = [tx_data for tx_data in batch if is_valid_transaction(tx_data)]
+    added = iter(blockchain.add_new_transactions(valid))
+    results = []
+    for tx_data in batch:
+        if is_valid_transaction(tx_data):
+            status, tx_id = next(added)
+            results.append({"status": status, "tx_id": tx_id})
+        else:
+            results.append({"status": "invalid", "tx_id": None})
+    accepted = sum(1 for result in results if result["status"] == "added")
+    return jsonify({"accepted": accepted, "results": results}), 200
 
 # Endpoint to mine a block (i.e. add unconfirmed transactions to the blockchain).
+# Mining runs in the background; the response carries the job id to poll.
 @app.route('/mine', methods=['GET'])
 def mine_unconfirmed_transactions():
-    result = blockchain.mine()
-    if not result:
-        return "No transactions to mine", 200
-    return f"Block #{result} is mined.", 200
+    job = mining_worker.submit()
+    return jsonify(job.to_dict()), 202
+
+# Endpoint to check the progress of a mining job.
+@app.route('/mine/<job_id>', methods=['GET'])
+def mining_job_status(job_id):
+    job = mining_worker.get_job(job_id)
+    if job is None:
+        return "Unknown mining job", 404
+    return jsonify(job.to_dict()), 200
+
+# Stream blocks start..end-1 as a JSON array, one block at a time.
+def stream_blocks(chain, start, end):
+    yield "["
+    for position in range(start, end):
+        # Convert block objects to dict for JSON serialization.
+        yield ("," if position > start else "") + json.dumps(chain[position].__dict__)
+    yield "]"
 
-# Endpoint to return the entire blockchain ledger.
+# Gzip a stream of text chunks, flushing every few blocks so data keeps flowing.
+def gzip_stream(chunks, flush_every=64):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 selects the gzip container
+    for count, chunk in enumerate(chunks, 1):
+        data = compressor.compress(chunk.encode())
+        if count % flush_every == 0:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Endpoint to return the blockchain ledger, optionally a range of it.
+# ?from=<index>&limit=<count> selects blocks; the ETag changes whenever the tip does.
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    chain_data = []
-    for block in blockchain.chain:
-        # Convert block objects to dict for JSON serialization.
-        chain_data.append(block.__dict__)
-    return jsonify(chain_data), 200
+    try:
+        start = max(int(request.args.get("from", 0)), 0)
+        limit = request.args.get("limit")
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return "Invalid range parameters", 400
+    if limit is not None and limit < 0:
+        return "Invalid range parameters", 400
+
+    with blockchain.lock:
+        length = len(blockchain.chain)
+        tip_hash = blockchain.last_block.hash
+    end = length if limit is None else min(start + limit, length)
+    start = min(start, end)
+
+    gzip_ok = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = f"{tip_hash}-{start}-{'' if limit is None else limit}" + ("-gzip" if gzip_ok else "")
+    headers = {"ETag": f'"{etag}"', "Vary": "Accept-Encoding", "X-Chain-Length": str(length)}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    # The chain is append-only, so positions below end stay valid while streaming.
+    body = stream_blocks(blockchain.chain, start, end)
+    if gzip_ok:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, status=200, headers=headers, mimetype="application/json")
+
+# Endpoint to prove that a transaction is included in a block. <tx> is the
+# transaction id or its position in the block.
+@app.route('/proof/<int:block_index>/<tx>', methods=['GET'])
+def get_inclusion_proof(block_index, tx):
+    with blockchain.lock:
+        block = blockchain.chain[block_index] if 0 <= block_index < len(blockchain.chain) else None
+    if block is None:
+        return "Block not found", 404
+    if block.merkle_root is None:
+        return "Block was mined without a Merkle root", 400
+    tx_ids = [transaction_id(transaction) for transaction in block.transactions]
+    if tx in tx_ids:
+        position = tx_ids.index(tx)
+    elif tx.isdigit() and int(tx) < len(tx_ids):
+        position = int(tx)
+    else:
+        return "Transaction not found in block", 404
+    header = block.content()
+    return jsonify({
+        "block_hash": block.hash,
+        "header": header,
+        "tx_id": tx_ids[position],
+        "position": position,
+        "proof": merkle_proof(block.transactions, position),
+    }), 200
+
+# Endpoint to look up a mined transaction by id.
+@app.route('/tx/<tx_id>', methods=['GET'])
+def get_transaction(tx_id):
+    location = blockchain.index.get_location(tx_id)
+    if location is None:
+        return "Transaction not found", 404
+    block_index, position = location
+    block = blockchain.chain[block_index]
+    return jsonify({
+        "tx_id": tx_id,
+        "block_index": block_index,
+        "block_hash": block.hash,
+        "position": position,
+        "transaction": block.transactions[position],
+    }), 200
+
+# Endpoint to list an address's transactions, oldest first.
+# ?from=<offset>&limit=<count> pages through the history.
+@app.route('/address/<name>/history', methods=['GET'])
+def get_address_history(name):
+    try:
+        start = max(int(request.args.get("from", 0)), 0)
+        limit = max(int(request.args.get("limit", 100)), 0)
+    except ValueError:
+        return "Invalid range parameters", 400
+    locations, total = blockchain.index.get_history(name, start, limit)
+    transactions = [
+        {"block_index": block_index, "position": position,
+         "transaction": blockchain.chain[block_index].transactions[position]}
+        for block_index, position in locations
+    ]
+    return jsonify({"address": name, "total": total, "from": start, "transactions": transactions}), 200
+
+# Endpoint to return an address's balance over all mined transactions.
+@app.route('/address/<name>/balance', methods=['GET'])
+def get_address_balance(name):
+    return jsonify({"address": name, "balance": blockchain.index.get_balance(name)}), 200
+
+# Endpoint to run a full-chain verification on demand.
+@app.route('/verify', methods=['GET'])
+def verify_chain():
+    error = blockchain.verify()
+    if error is None:
+        return jsonify({"valid": True, "length": len(blockchain.chain)}), 200
+    return jsonify({"valid": False, "first_invalid_block": error}), 200
 
 # Start the Flask app and listen on port 5000
 if __name__ == '__main__':
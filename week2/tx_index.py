@@ -0,0 +1,50 @@
+from mempool import transaction_id
+
+
+# Lookup tables over the mined transactions, updated one block at a time.
+class TransactionIndex:
+    def __init__(self):
+        self.locations = {}  # tx id -> (block index, position in block)
+        self.history = {}  # address -> list of (block index, position), oldest first
+        self.balances = {}  # address -> running balance
+
+    def add_block(self, block):
+        for position, transaction in enumerate(block.transactions):
+            location = (block.index, position)
+            # The same transaction can appear in more than one legacy block; keep the first
+            self.locations.setdefault(transaction_id(transaction), location)
+            sender = transaction.get("sender")
+            receiver = transaction.get("receiver")
+            for address in {sender, receiver}:
+                if address is not None:
+                    self.history.setdefault(address, []).append(location)
+            amount = transaction.get("amount")
+            if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+                if sender is not None:
+                    self.balances[sender] = self.balances.get(sender, 0) - amount
+                if receiver is not None:
+                    self.balances[receiver] = self.balances.get(receiver, 0) + amount
+
+    def to_state(self):
+        # Plain JSON-serializable form, stored in checkpoints.
+        return {"locations": self.locations, "history": self.history, "balances": self.balances}
+
+    @classmethod
+    def from_state(cls, state):
+        # Locations come back as two-item lists, which unpack the same as tuples
+        index = cls()
+        index.locations = state["locations"]
+        index.history = state["history"]
+        index.balances = state["balances"]
+        return index
+
+    def get_location(self, tx_id):
+        return self.locations.get(tx_id)
+
+    def get_history(self, address, start=0, limit=None):
+        locations = self.history.get(address, [])
+        end = len(locations) if limit is None else start + limit
+        return locations[start:end], len(locations)
+
+    def get_balance(self, address):
+        return self.balances.get(address, 0)
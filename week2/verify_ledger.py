@@ -0,0 +1,220 @@
+import json
+import os
+import sys
+import time
+import zlib
+from multiprocessing import Pool
+
+from block import block_from_dict
+from ledger_log import RECORD_HEADER
+
+DIFFICULTY = 2  # Same target as Blockchain.difficulty
+CHUNK_BYTES = 16 * 1024 * 1024  # Bytes of ledger each worker verifies at a time
+MAX_RECORD_BYTES = 64 * 1024 * 1024  # Larger lengths are not taken as record headers
+
+_decoder = json.JSONDecoder()
+
+
+# Verifies blockchain.log or the legacy blockchain.json without loading either
+# whole: the file is cut into byte ranges, a process pool verifies the blocks
+# inside each range, and the links between ranges are checked in order.
+# Usage: python verify_ledger.py [ledger file] [workers]
+
+def links_to(previous_hash, merkle_root, previous):
+    # Whether a block with this previous_hash follows previous. Legacy blocks
+    # may also point at the legacy hash of the genesis block before them.
+    return previous_hash == previous["hash"] or (merkle_root is None and previous_hash == previous["legacy_hash"])
+
+
+def check_block(block, previous, difficulty):
+    # Why block is invalid after previous (None for the first block), or None
+    computed_hash = block.compute_hash()
+    if computed_hash != block.hash:
+        return "stored hash does not match block content"
+    reason = block.merkle_error()
+    if reason is not None:
+        return reason
+    if previous is not None:
+        if block.index != previous["index"] + 1:
+            return "index does not follow the preceding block"
+        if not links_to(block.previous_hash, block.merkle_root, previous):
+            return "previous_hash does not match the preceding block"
+    elif block.index == 0 and block.previous_hash != "0":
+        return "genesis block does not start the chain"
+    if block.index > 0 and not computed_hash.startswith("0" * difficulty):
+        return "hash does not meet the proof-of-work target"
+    return None
+
+
+def verify_blocks(blocks, difficulty):
+    # Verify a run of blocks; the first one is only checked on its own, its
+    # link to the block before is checked when chunks are stitched together.
+    summary = {"count": 0, "first": None, "last": None, "error": None}
+    previous = None
+    for block_data in blocks:
+        if isinstance(block_data, str):
+            summary["error"] = {"index": previous["index"] + 1 if previous else None, "reason": block_data}
+            break
+        try:
+            block = block_from_dict(block_data, check_merkle=False)  # check_block reports it instead
+        except TypeError:
+            summary["error"] = {"index": block_data.get("index"), "reason": "block is missing fields"}
+            break
+        reason = check_block(block, previous, difficulty)
+        if reason is not None:
+            summary["error"] = {"index": block.index, "reason": reason}
+            break
+        previous = {"index": block.index, "hash": block.hash, "previous_hash": block.previous_hash,
+                    "merkle_root": block.merkle_root, "legacy_hash": block.legacy_link_hash()}
+        if summary["first"] is None:
+            summary["first"] = previous
+        summary["last"] = previous
+        summary["count"] += 1
+    return summary
+
+
+def read_range(path, start, end):
+    with open(path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start)
+
+
+# The bytes of one range of blockchain.log, read further on demand when the
+# last record runs past the end of the range.
+class _LogRange:
+    def __init__(self, file, start, end):
+        self.file = file
+        file.seek(start)
+        self.data = file.read(end - start)
+
+    def get(self, position, length):
+        missing = position + length - len(self.data)
+        if missing > 0:
+            self.data += self.file.read(missing)
+        return self.data[position:position + length]
+
+
+def log_records(path, start, end):
+    # Records of blockchain.log that start in [start, end). A range can begin
+    # inside a record, so the first record boundary is found by looking for a
+    # header whose length and CRC match the bytes after it.
+    with open(path, "rb") as file:
+        chunk = _LogRange(file, start, end)
+        position = 0 if start == 0 else _next_record(chunk, 0)
+        while position is not None and position < end - start:
+            header = chunk.get(position, RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                yield "ledger ends inside a record header"
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = chunk.get(position + RECORD_HEADER.size, length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                yield "record is torn or fails its checksum"
+                return
+            yield json.loads(payload)
+            position += RECORD_HEADER.size + length
+
+
+def _next_record(chunk, position):
+    # Payloads are blocks serialized with sorted keys, so a record starts 8
+    # bytes before '{"hash":' or '{"index":'; the CRC rules out lookalikes
+    while True:
+        brace = min((found for found in (chunk.data.find(b'{"hash":', position + RECORD_HEADER.size),
+                                         chunk.data.find(b'{"index":', position + RECORD_HEADER.size)) if found >= 0),
+                    default=-1)
+        if brace < 0:
+            return None
+        start = brace - RECORD_HEADER.size
+        length, checksum = RECORD_HEADER.unpack(chunk.data[start:brace])
+        if length <= MAX_RECORD_BYTES and zlib.crc32(chunk.get(brace, length)) == checksum:
+            return start
+        position = start + 1
+
+
+def json_blocks(path, start, end):
+    # Blocks of the JSON array that start in [start, end)
+    text = read_range(path, start, end).decode("ascii")
+    position = 0
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,[":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            return
+        try:
+            block_data, position = _decoder.raw_decode(text, position)
+        except ValueError:
+            yield "block is not valid JSON"
+            return
+        yield block_data
+
+
+def json_ranges(path, chunk_bytes):
+    # Cut the indent=4 JSON array just before a top-level block: a line that
+    # is exactly four spaces and "{" (strings never contain raw newlines)
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as file:
+        while start < size:
+            file.seek(min(start + chunk_bytes, size))
+            end = size
+            while True:
+                buffer = file.read(1024 * 1024)
+                found = buffer.find(b"\n    {")
+                if found >= 0:
+                    end = file.tell() - len(buffer) + found + 1
+                    break
+                if file.tell() >= size:
+                    break
+                file.seek(-5, os.SEEK_CUR)  # The marker may straddle two reads
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _verify_range(args):
+    path, start, end, difficulty = args
+    if path.endswith(".json"):
+        return verify_blocks(json_blocks(path, start, end), difficulty)
+    return verify_blocks(log_records(path, start, end), difficulty)
+
+
+def verify_ledger(path, workers=None, chunk_bytes=CHUNK_BYTES, difficulty=DIFFICULTY):
+    # Returns (block count, None) for a valid ledger, otherwise the first bad
+    # block as (blocks checked before it, {"index": ..., "reason": ...})
+    if path.endswith(".json"):
+        ranges = json_ranges(path, chunk_bytes)
+    else:
+        size = os.path.getsize(path)
+        ranges = [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+    count = 0
+    previous = None
+    with Pool(workers) as pool:
+        for summary in pool.imap(_verify_range, [(path, start, end, difficulty) for start, end in ranges]):
+            first = summary["first"]
+            if previous is not None and first is not None:
+                if first["index"] != previous["index"] + 1:
+                    # A record corrupt right at a range boundary is skipped over
+                    return count, {"index": previous["index"] + 1, "reason": "block is missing or unreadable"}
+                if not links_to(first["previous_hash"], first["merkle_root"], previous):
+                    return count, {"index": first["index"], "reason": "previous_hash does not match the preceding block"}
+            count += summary["count"]
+            if summary["error"] is not None:
+                if summary["error"]["index"] is None and previous is not None:
+                    summary["error"]["index"] = previous["index"] + 1
+                return count, summary["error"]
+            previous = summary["last"] or previous
+    return count, None
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "blockchain.log"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    started = time.time()
+    count, error = verify_ledger(path, workers)
+    elapsed = time.time() - started
+    if error is None:
+        print(f"{path}: {count} blocks valid ({elapsed:.2f}s)")
+    else:
+        print(f"{path}: first invalid block {error['index']}: {error['reason']} ({count} valid blocks before it, {elapsed:.2f}s)")
+        sys.exit(1)
@@ -0,0 +1,203 @@
+import json
+import os
+import queue
+import threading
+from array import array
+from collections import OrderedDict
+
+from incentives import IncentiveLedger
+from patient_index import PatientIndex
+
+
+# Snapshot of the chain as of block N: the tip, the block count, where block N
+# ends in the ledger file and any state derived from the chain. The start
+# offset of every block is kept in a binary sidecar file so earlier blocks can
+# be read lazily.
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.offsets_path = path + ".offsets"
+
+    def save(self, block_count, tip_hash, file_offset, offsets, state):
+        # Write both files to temporary names first so a crash never leaves a
+        # half-written checkpoint behind.
+        with open(self.offsets_path + ".tmp", "wb") as file:
+            offsets[:block_count].tofile(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.offsets_path + ".tmp", self.offsets_path)
+        checkpoint = {
+            "block_count": block_count,
+            "tip_hash": tip_hash,
+            "file_offset": file_offset,
+            "state": state,
+        }
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(checkpoint, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    def load(self):
+        # Returns the checkpoint with its offsets, or None if there is no usable one.
+        if not os.path.exists(self.path) or not os.path.exists(self.offsets_path):
+            return None
+        try:
+            with open(self.path, "r") as file:
+                checkpoint = json.load(file)
+            offsets = array("Q")
+            with open(self.offsets_path, "rb") as file:
+                offsets.frombytes(file.read())
+        except (ValueError, OSError):
+            return None
+        if len(offsets) < checkpoint["block_count"]:
+            return None
+        checkpoint["offsets"] = offsets[:checkpoint["block_count"]]
+        return checkpoint
+
+
+# Writes checkpoints on a background thread so the group committer never waits
+# for the derived state to be serialized and fsynced. The writer follows every
+# committed batch and fork switch with its own copy of that state, so nothing
+# is copied on the commit path, and saves once every `every` blocks.
+class CheckpointWriter:
+    def __init__(self, checkpoint, block_count, offsets, every):
+        self.checkpoint = checkpoint
+        self.every = every
+        self.block_count = block_count  # Blocks covered by the writer's state
+        self.saved_count = block_count  # Blocks covered by the checkpoint on disk
+        self.offsets = offsets  # Start offset of each of those blocks in the ledger file
+        self.file_offset = None  # Where the last of them ends
+        self.tip_hash = None
+        self.patient_index = None
+        self.incentives = None
+        self.error = None  # Why the writer stopped checkpointing, if it did
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def committed(self, blocks, offsets, file_offset):
+        # Blocks that were just made durable, starting at the given offsets
+        self.queue.put(("commit", blocks, offsets, file_offset, blocks[-1].hash))
+
+    def truncated(self, count, dropped, file_offset, tip_hash):
+        # A fork switch cut the ledger back to count blocks, dropping these
+        self.queue.put(("truncate", dropped, count, file_offset, tip_hash))
+
+    def flush(self, save=False):
+        # Wait until the writer has caught up, saving a checkpoint first if asked
+        if save:
+            self.queue.put(("save",))
+        self.queue.join()
+
+    def _load(self):
+        # The state as of the latest checkpoint, parsed again for the writer's own copy
+        self.patient_index = PatientIndex()
+        self.incentives = IncentiveLedger()
+        if self.block_count:
+            state = self.checkpoint.load()["state"]
+            self.patient_index = PatientIndex.from_state(state["patients"])
+            self.incentives = IncentiveLedger.from_state(state["incentives"])
+
+    def _apply(self, operation):
+        if operation[0] == "commit":
+            _, blocks, offsets, self.file_offset, self.tip_hash = operation
+            for block in blocks:
+                self.patient_index.add(block.index, block.data)
+                self.incentives.apply(block.data)
+            self.offsets.extend(offsets)
+            self.block_count += len(blocks)
+            if self.block_count - self.saved_count >= self.every:
+                self._save()
+        elif operation[0] == "truncate":
+            _, dropped, count, self.file_offset, self.tip_hash = operation
+            self.patient_index.truncate(count, dropped)
+            for block in reversed(dropped):
+                self.incentives.revert(block.data)
+            del self.offsets[count:]
+            self.block_count = count
+            self.saved_count = min(self.saved_count, count)
+        elif self.block_count > self.saved_count:
+            self._save()
+
+    def _save(self):
+        state = {"patients": self.patient_index.to_state(), "incentives": self.incentives.to_state()}
+        self.checkpoint.save(self.block_count, self.tip_hash, self.file_offset, self.offsets, state)
+        self.saved_count = self.block_count
+
+    def _run(self):
+        # Nothing may end this loop, or flush() would wait forever. A failed
+        # save only skips that checkpoint; anything else leaves the writer's
+        # state in doubt, so it stops checkpointing and the last good
+        # checkpoint on disk stays in place.
+        try:
+            self._load()
+        except Exception as e:
+            self._stop(e)
+        while True:
+            operation = self.queue.get()
+            try:
+                if self.error is None:
+                    self._apply(operation)
+            except OSError as e:
+                print(f"Checkpoint at block {self.block_count} failed: {e}")
+            except Exception as e:
+                self._stop(e)
+            finally:
+                self.queue.task_done()
+
+    def _stop(self, error):
+        self.error = error
+        print(f"Checkpoint writer stopped at block {self.block_count}: {error!r}")
+
+
+# List-like chain whose first base_count blocks stay on disk and are loaded on
+# demand (with a bounded cache); blocks after that are held in memory.
+class LazyChain:
+    def __init__(self, base_count=0, load_block=None, cache_size=10000):
+        self.base_count = base_count
+        self.load_block = load_block  # Loads block i < base_count from storage
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()  # Readers share the cache across threads
+        self.blocks = []  # Blocks after the checkpoint
+
+    def __len__(self):
+        return self.base_count + len(self.blocks)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("block index out of range")
+        if position >= self.base_count:
+            return self.blocks[position - self.base_count]
+        with self.cache_lock:
+            block = self.cache.get(position)
+            if block is not None:
+                self.cache.move_to_end(position)
+                return block
+        block = self.load_block(position)
+        with self.cache_lock:
+            self.cache[position] = block
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return block
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def append(self, block):
+        self.blocks.append(block)
+
+    def truncate(self, count):
+        # Drop every block from position count on
+        if count >= self.base_count:
+            del self.blocks[count - self.base_count:]
+            return
+        self.base_count = count
+        self.blocks = []
+        with self.cache_lock:
+            for position in [position for position in self.cache if position >= count]:
+                del self.cache[position]
@@ -0,0 +1,73 @@
+import json
+import sys
+import time
+
+# E-cash earned per record: action -> (field naming the user who is paid, reward)
+REWARDS = {
+    "blood_test": ("doctor", 10),
+    "report": ("diagnostic", 5),
+    "prescription": ("doctor", 5),
+}
+
+
+# Incentive balances derived from the chain alone: every block's data is
+# applied in chain order, and reverted when a fork switch drops the block, so
+# the same chain always yields the same balances.
+class IncentiveLedger:
+    def __init__(self):
+        self.balances = {}  # user -> balance
+
+    def reward(self, data):
+        # (user, amount) earned by a block, or None
+        if not isinstance(data, dict) or data.get("action") not in REWARDS:
+            return None
+        field, amount = REWARDS[data["action"]]
+        user = data.get(field)
+        if user is None:
+            return None
+        return str(user), amount
+
+    def apply(self, data):
+        reward = self.reward(data)
+        if reward is not None:
+            user, amount = reward
+            self.balances[user] = self.balances.get(user, 0) + amount
+
+    def revert(self, data):
+        reward = self.reward(data)
+        if reward is not None:
+            user, amount = reward
+            self.balances[user] -= amount
+
+    def get_balance(self, user):
+        return self.balances.get(user, 0)
+
+    def to_state(self):
+        # Plain JSON-serializable form, stored in checkpoints.
+        return dict(self.balances)
+
+    @classmethod
+    def from_state(cls, state):
+        ledger = cls()
+        ledger.balances = dict(state)
+        return ledger
+
+    @classmethod
+    def rebuild(cls, ledger_file):
+        # Recompute every balance from the ledger file, ignoring checkpoints.
+        # The file is parsed in one go, which is much faster than block by block.
+        ledger = cls()
+        with open(ledger_file, "r") as file:
+            for block_data in json.load(file):
+                ledger.apply(block_data.get("data"))
+        return ledger
+
+
+# Audit: python incentives.py <ledger file> rebuilds the balances from scratch
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "blockchain_ledger.json"
+    started = time.time()
+    audit = IncentiveLedger.rebuild(path)
+    for user, balance in sorted(audit.balances.items()):
+        print(f"{user}: {balance}")
+    print(f"Rebuilt from {path} in {time.time() - started:.2f}s")
@@ -0,0 +1,206 @@
+import json
+import os
+import textwrap
+import threading
+from array import array
+
+_decoder = json.JSONDecoder()
+
+# Characters that may sit between blocks in the JSON array
+_SEPARATORS = " \t\r\n,["
+
+# One lock per ledger path, shared by every LedgerFile in the process, so
+# appends from different nodes never interleave their bytes.
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def _lock_for(path):
+    with _file_locks_guard:
+        return _file_locks.setdefault(os.path.realpath(path), threading.Lock())
+
+
+def encode_block(block_data):
+    # One array element laid out exactly as json.dump(chain, f, indent=4) writes it.
+    return textwrap.indent(json.dumps(block_data, indent=4), "    ")
+
+
+def _block_follows(text, position):
+    # Whether a complete block starts somewhere after position. Blocks start
+    # on a line of their own, indented by four spaces.
+    start = text.find("\n    {", position)
+    while start >= 0:
+        try:
+            _decoder.raw_decode(text, start + 5)
+            return True
+        except ValueError:
+            start = text.find("\n    {", start + 1)
+    return False
+
+
+# blockchain_ledger.json kept as the same indent=4 JSON array, but new blocks are
+# appended in place instead of rewriting the file, and the byte offset where
+# each block starts is remembered so single blocks can be read back later.
+class LedgerFile:
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array("Q")  # Byte offset where each block starts
+        self.end_offset = 0  # Byte offset just past the last block's closing brace
+        self.lock = _lock_for(path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def scan(self, offset=0, offsets=None):
+        # Yield every block stored from the given byte offset on. When starting
+        # past the beginning, offsets must hold the start of each earlier block.
+        # An unparseable tail is left over from an interrupted append and is
+        # cut off; if whole blocks follow the bad spot, the ledger was damaged
+        # some other way and ValueError is raised instead of dropping them.
+        self.offsets = array("Q", offsets or [])
+        self.end_offset = offset
+        if not self.exists():
+            return
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            text = file.read().decode("ascii")  # json.dumps escapes non-ASCII, so chars == bytes
+        position = 0
+        while True:
+            while position < len(text) and text[position] in _SEPARATORS:
+                position += 1
+            if position >= len(text) or text[position] != "{":
+                break
+            try:
+                block_data, end = _decoder.raw_decode(text, position)
+            except ValueError:
+                break
+            self.offsets.append(offset + position)
+            self.end_offset = offset + end
+            position = end
+            yield block_data
+        if text[position:].strip() != "]":
+            if _block_follows(text, position):
+                raise ValueError(f"{self.path}: block at byte {offset + position} is unreadable but more blocks "
+                                 f"follow it; repair the file by hand")
+            self._write_trailer()
+
+    def read(self, position):
+        # Read a single block by its position in the chain.
+        return _decoder.raw_decode(self._text(position))[0]
+
+    def append(self, blocks_data):
+        # Append blocks by overwriting the closing bracket, then restore it and
+        # fsync. The file is a valid JSON array again once this returns.
+        with self.lock:
+            mode = "r+b" if self.exists() and self.offsets else "wb"
+            with open(self.path, mode) as file:
+                if self.offsets:
+                    file.seek(self.end_offset)
+                    offset = self.end_offset
+                else:
+                    file.write(b"[")
+                    offset = 1
+                for block_data in blocks_data:
+                    prefix = ",\n" if self.offsets else "\n"
+                    encoded = (prefix + encode_block(block_data)).encode()
+                    file.write(encoded)
+                    self.offsets.append(offset + encoded.index(b"{"))
+                    offset += len(encoded)
+                self.end_offset = offset
+                file.write(b"\n]")
+                file.truncate()
+                file.flush()
+                os.fsync(file.fileno())
+
+    def truncate(self, count):
+        # Drop every block from position count on, e.g. when switching to
+        # another fork, and leave a valid JSON array behind.
+        with self.lock:
+            if count:
+                self.end_offset = self.offsets[count - 1] + _decoder.raw_decode(self._text(count - 1))[1]
+            else:
+                self.end_offset = 0
+            del self.offsets[count:]
+            self._write_trailer()
+
+    def _text(self, position):
+        start = self.offsets[position]
+        end = self.offsets[position + 1] if position + 1 < len(self.offsets) else self.end_offset
+        with open(self.path, "rb") as file:
+            file.seek(start)
+            return file.read(end - start).decode("ascii")
+
+    def _write_trailer(self):
+        with open(self.path, "r+b") as file:
+            if self.offsets:
+                file.seek(self.end_offset)
+                file.write(b"\n]")
+            else:
+                file.write(b"[]")
+            file.truncate()
+            file.flush()
+            os.fsync(file.fileno())
+
+
+# Group commit for the ledger: callers hand over blocks and wait, while one
+# writer thread appends everything queued since its last write with a single
+# write and fsync. Under concurrency many add_block calls share one disk flush,
+# and nobody holds the chain lock while the disk works.
+class GroupCommitter:
+    def __init__(self, ledger, on_commit=None):
+        self.ledger = ledger
+        self.on_commit = on_commit  # Called from the writer thread with each durable batch
+        self.condition = threading.Condition()
+        self.commit_lock = threading.RLock()  # Held while a batch is written and on_commit runs
+        self.queue = []
+        self.submitted = len(ledger.offsets)  # Blocks handed over, counting those already stored
+        self.durable = len(ledger.offsets)  # Blocks known to be on disk
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, blocks):
+        # Queue blocks (in chain order) and return the count to wait for.
+        with self.condition:
+            if self.error is not None:
+                raise RuntimeError(f"Ledger writes failed: {self.error}")
+            self.queue.extend(blocks)
+            self.submitted += len(blocks)
+            self.condition.notify_all()
+            return self.submitted
+
+    def wait(self, count):
+        # Block until the first count blocks are durable.
+        with self.condition:
+            while self.durable < count and self.error is None:
+                self.condition.wait()
+            if self.durable < count:
+                raise RuntimeError(f"Ledger writes failed: {self.error}")
+
+    def truncate(self, count):
+        # Cut the ledger back to count blocks. Only valid once every submitted
+        # block is durable and nothing new is being submitted.
+        with self.commit_lock, self.condition:
+            self.ledger.truncate(count)
+            self.submitted = self.durable = count
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                batch = self.queue
+                self.queue = []
+            try:
+                with self.commit_lock:
+                    self.ledger.append([block.__dict__ for block in batch])
+                    if self.on_commit is not None:
+                        self.on_commit(batch)
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.durable += len(batch)
+                self.condition.notify_all()
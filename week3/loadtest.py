@@ -0,0 +1,235 @@
+import argparse
+import itertools
+import os
+import random
+import secrets
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from incentives import REWARDS
+from protocol import ConnectionPool
+from prog import NodeServer
+
+# Node that serves each action, as an offset from the base port (the same
+# layout main() uses: doctor 1, diagnostic 2, pharmacy 3, hospital 4). Patient
+# lookups go to the doctor node, which holds the patient's earlier records
+# without waiting for replication.
+ACTION_NODES = {
+    "blood_test": 1,
+    "report": 2,
+    "prescription": 1,
+    "medicine_purchase": 3,
+    "get_patient_history": 1,
+    "get_latest_record": 1,
+    "get_balance": 1,
+}
+
+# Order a patient goes through the actions; the mix says how often each occurs
+WORKFLOW = ["blood_test", "report", "prescription", "medicine_purchase",
+            "get_patient_history", "get_latest_record", "get_balance"]
+DEFAULT_MIX = "blood_test=1,report=1,prescription=1,medicine_purchase=1,get_patient_history=1,get_latest_record=1,get_balance=1"
+
+STAFF = {"doctor": "doc123", "diagnostic": "diag123", "pharmacy": "pharm123"}
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        action, _, count = item.partition("=")
+        action = action.strip()
+        if action not in ACTION_NODES:
+            raise ValueError(f"Unknown action in mix: {action}")
+        mix[action] = int(count or 1)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+# Simulates patients going through the hospital workflow against running
+# nodes: concurrency patients at a time, each action followed by a think time.
+class LoadTest:
+    def __init__(self, host, base_port, patients, concurrency, think_time, mix, seed=None):
+        self.host = host
+        self.base_port = base_port
+        self.patients = patients
+        self.concurrency = concurrency
+        self.think_time = think_time  # Mean seconds between a patient's actions
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.pool = ConnectionPool(max_idle=concurrency)
+        self.run_id = f"{int(time.time())}-{os.getpid()}"
+        self.next_patient = itertools.count()
+        self.tokens = {}
+        self.latencies = defaultdict(list)  # action -> seconds per successful request
+        self.errors = defaultdict(int)  # action -> failed requests
+        self.missed = defaultdict(int)  # action -> reads that missed a write the same node had confirmed
+        self.rewards = defaultdict(int)  # user -> incentives the workload should have earned
+        self.lock = threading.Lock()  # Guards the error, missed read and reward counts
+
+    def request(self, node, request):
+        return self.pool.request(self.host, self.base_port + node, request)
+
+    def login(self):
+        for username, password in STAFF.items():
+            response = self.request(1, {"action": "login", "username": username, "password": password})
+            if response.get("status") != "success":
+                raise RuntimeError(f"Login failed for {username}: {response.get('message')}")
+            self.tokens[username] = response["token"]
+
+    def balances(self):
+        # Incentive balance of each rewarded user, as every node reports it
+        result = {}
+        for username in sorted({field for field, _ in REWARDS.values()}):
+            result[username] = []
+            for node in range(1, 5):
+                response = self.request(node, {"action": "get_balance", "user": username, "token": self.tokens[username]})
+                result[username].append(response.get("balance"))
+        return result
+
+    def build_request(self, action, patient_id):
+        if action in ("get_patient_history", "get_latest_record"):
+            return {"action": action, "patient_id": patient_id, "token": self.tokens["doctor"]}
+        if action == "get_balance":
+            return {"action": action, "user": "doctor", "token": self.tokens["doctor"]}
+        owner = {"blood_test": "doctor", "report": "diagnostic", "prescription": "doctor",
+                 "medicine_purchase": "pharmacy"}[action]
+        data = {"action": action, "patient_id": patient_id, "doctor": "doctor"}
+        if action == "report":
+            data["diagnostic"] = "diagnostic"
+        if action == "medicine_purchase":
+            data["pharmacy"] = "pharmacy"
+        return {"action": "add_block", "data": data, "token": self.tokens[owner]}
+
+    def missed_write(self, action, response, confirmed):
+        # Whether a patient lookup missed records the same node had already
+        # confirmed writing; records written on other nodes may still be
+        # replicating and do not count
+        if action == "get_patient_history":
+            return response.get("status") == "success" and response.get("total", 0) < confirmed
+        if action == "get_latest_record":
+            return response.get("status") == "failure" and confirmed > 0
+        return False
+
+    def run_patient(self, patient_id):
+        confirmed = defaultdict(int)  # node -> this patient's writes it confirmed
+        for action in WORKFLOW:
+            for _ in range(self.mix.get(action, 0)):
+                node = ACTION_NODES[action]
+                request = self.build_request(action, patient_id)
+                started = time.perf_counter()
+                try:
+                    response = self.request(node, request)
+                except Exception:
+                    response = {"status": "error"}
+                elapsed = time.perf_counter() - started
+                if self.missed_write(action, response, confirmed[node]):
+                    with self.lock:
+                        self.missed[action] += 1
+                elif response.get("status") == "success":
+                    if request["action"] == "add_block":
+                        confirmed[node] += 1
+                    self.latencies[action].append(elapsed)
+                    if action in REWARDS:
+                        field, amount = REWARDS[action]
+                        with self.lock:
+                            self.rewards[request["data"][field]] += amount
+                else:
+                    with self.lock:
+                        self.errors[action] += 1
+                if self.think_time > 0:
+                    time.sleep(self.random.expovariate(1 / self.think_time))
+
+    def worker(self):
+        while True:
+            number = next(self.next_patient)
+            if number >= self.patients:
+                return
+            self.run_patient(f"loadtest-{self.run_id}-{number}")
+
+    def run(self, settle_timeout=30):
+        self.login()
+        before = self.balances()
+        started = time.perf_counter()
+        workers = [threading.Thread(target=self.worker) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        # Wait for replication to settle, then check every node agrees with
+        # the rewards the workload earned
+        expected = {username: balances[0] + self.rewards.get(username, 0) for username, balances in before.items()}
+        deadline = time.time() + settle_timeout
+        while True:
+            after = self.balances()
+            consistent = all(balance == expected[username] for username, balances in after.items() for balance in balances)
+            if consistent or time.time() >= deadline:
+                break
+            time.sleep(0.5)
+        self.report(elapsed, expected, after, consistent)
+        return consistent and not sum(self.errors.values()) and not sum(self.missed.values())
+
+    def report(self, elapsed, expected, after, consistent):
+        requests = (sum(len(values) for values in self.latencies.values()) + sum(self.errors.values())
+                    + sum(self.missed.values()))
+        print(f"\n{self.patients} patients, concurrency {self.concurrency}, think time {self.think_time}s")
+        print(f"{requests} requests in {elapsed:.2f}s: {requests / elapsed:.1f} requests/s, "
+              f"{self.patients / elapsed:.1f} patients/s")
+        print(f"\n{'action':<22}{'ok':>8}{'errors':>8}{'missed':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for action in WORKFLOW:
+            if action not in self.mix:
+                continue
+            values = sorted(self.latencies[action])
+            print(f"{action:<22}{len(values):>8}{self.errors[action]:>8}{self.missed[action]:>8}"
+                  f"{percentile(values, 0.50) * 1000:>10.2f}{percentile(values, 0.95) * 1000:>10.2f}"
+                  f"{percentile(values, 0.99) * 1000:>10.2f}")
+        if sum(self.missed.values()):
+            print("\nmissed: reads that did not return a record the same node had confirmed writing "
+                  "(read-after-write violations, not replication lag)")
+        print("\nBalances (expected vs doctor, diagnostic, pharmacy, hospital nodes):")
+        for username, balances in after.items():
+            print(f"  {username}: expected {expected[username]}, nodes {balances}")
+        print("Balances consistent" if consistent else "Balances INCONSISTENT")
+
+
+def start_nodes(host, base_port, directory):
+    # The four nodes from main(), with their ledgers in a scratch directory
+    peer_secret = secrets.token_hex(32)
+    addresses = {role: (host, base_port + offset)
+                 for offset, role in enumerate(["doctor", "diagnostic", "pharmacy", "hospital"], start=1)}
+    for role, (node_host, port) in addresses.items():
+        peers = [address for other, address in addresses.items() if other != role]
+        node = NodeServer(node_host, port, f"{role}_node", ledger_file=os.path.join(directory, f"{role}_node_ledger.json"),
+                          peers=peers, peer_secret=peer_secret)
+        node.daemon = True
+        node.start()
+    time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the week3 hospital nodes with simulated patients.")
+    parser.add_argument("--patients", type=int, default=200, help="patients to simulate")
+    parser.add_argument("--concurrency", type=int, default=16, help="patients in the workflow at once")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds between a patient's actions")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="how often each action occurs per patient")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000, help="base port; nodes listen on port+1 to port+4")
+    parser.add_argument("--external", action="store_true", help="target running nodes instead of starting them")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the think time")
+    args = parser.parse_args()
+
+    if not args.external:
+        start_nodes(args.host, args.port, tempfile.mkdtemp(prefix="loadtest-"))
+    test = LoadTest(args.host, args.port, args.patients, args.concurrency, args.think_time, parse_mix(args.mix), args.seed)
+    raise SystemExit(0 if test.run() else 1)
+
+
+if __name__ == "__main__":
+    main()
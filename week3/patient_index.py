@@ -0,0 +1,51 @@
+import heapq
+from array import array
+
+
+# Maps every patient to the positions of their blocks in the chain, overall
+# and per record type (blood_test, report, ...), so one patient's records can
+# be found without walking the whole ledger. Positions are kept in chain order.
+class PatientIndex:
+    def __init__(self):
+        self.records = {}  # patient_id -> block positions
+        self.records_by_action = {}  # patient_id -> {action: block positions}
+
+    def add(self, position, data):
+        patient_id = data.get("patient_id") if isinstance(data, dict) else None
+        if patient_id is None:
+            return
+        patient_id = str(patient_id)
+        action = str(data.get("action") or "")
+        self.records.setdefault(patient_id, array("Q")).append(position)
+        self.records_by_action.setdefault(patient_id, {}).setdefault(action, array("Q")).append(position)
+
+    def truncate(self, count, dropped_blocks):
+        # Forget the dropped blocks, all of them at positions from count on
+        for block in dropped_blocks:
+            patient_id = block.data.get("patient_id") if isinstance(block.data, dict) else None
+            if patient_id is None:
+                continue
+            patient_id = str(patient_id)
+            positions = [self.records.get(patient_id)]
+            positions.extend(self.records_by_action.get(patient_id, {}).values())
+            for block_positions in positions:
+                while block_positions and block_positions[-1] >= count:
+                    block_positions.pop()
+
+    def positions(self, patient_id, action=None):
+        if action is None:
+            return self.records.get(str(patient_id), array("Q"))
+        return self.records_by_action.get(str(patient_id), {}).get(action, array("Q"))
+
+    def to_state(self):
+        # JSON-friendly form stored in checkpoints
+        return {patient_id: {action: list(positions) for action, positions in actions.items()}
+                for patient_id, actions in self.records_by_action.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls()
+        for patient_id, actions in state.items():
+            index.records_by_action[patient_id] = {action: array("Q", positions) for action, positions in actions.items()}
+            index.records[patient_id] = array("Q", heapq.merge(*actions.values()))
+        return index
@@ -3,7 +3,18 @@ import threading
 import time
 import json
 import hashlib
+import hmac
 import os
+import queue
+import secrets
+import shutil
+from checkpoint import Checkpoint, CheckpointWriter, LazyChain
+from incentives import IncentiveLedger
+from ledger_file import GroupCommitter, LedgerFile
+from patient_index import PatientIndex
+from protocol import ConnectionPool, ProtocolError, recv_frame, send_frame
+from server_core import SelectorServerCore
+from sessions import SessionCache, verify_password
 
 # =============================================================================
 # Blockchain Components
@@ -23,95 +34,411 @@ class Block:
         return hashlib.sha256(block_string).hexdigest()
 
 class Blockchain:
-    def __init__(self):
-        self.chain = []
+    ledger_file = "blockchain_ledger.json"
+    checkpoint_file = "blockchain_ledger.checkpoint"  # Snapshot used to skip parsing the whole ledger
+    checkpoint_every = 1000  # Write a checkpoint after this many new blocks
+
+    # Each node can keep its own ledger file; its checkpoint is stored next to it.
+    def __init__(self, ledger_file=None, node_id=None):
+        if ledger_file is not None:
+            if not os.path.exists(ledger_file) and os.path.exists(self.ledger_file):
+                # Start from the ledger all nodes used to share
+                shutil.copyfile(self.ledger_file, ledger_file)
+            self.ledger_file = ledger_file
+            self.checkpoint_file = os.path.splitext(ledger_file)[0] + ".checkpoint"
+        self.node_id = node_id  # Node this chain belongs to
+        self.chain = LazyChain()
+        self.ledger = LedgerFile(self.ledger_file)
+        self.checkpoint = Checkpoint(self.checkpoint_file)
+        self.checkpointed_blocks = 0  # Block count covered by the checkpoint restored at startup
+        self.patient_index = PatientIndex()  # Committed blocks of each patient
+        self.incentives = IncentiveLedger()  # Balances derived from the committed blocks
+        self.lock = threading.Lock()  # Guards the in-memory chain tip; never held during disk I/O
+        self.version = 0  # Odd while a fork switch is replacing blocks
         self.load_chain_from_file()  # Load existing chain from file or create genesis block
+        self.committed_length = len(self.chain)  # Blocks known to be durable; what readers see
+        self.checkpoint_writer = CheckpointWriter(self.checkpoint, self.checkpointed_blocks,
+                                                  self.ledger.offsets[:self.checkpointed_blocks], self.checkpoint_every)
+        if len(self.chain) > self.checkpointed_blocks:
+            # Blocks parsed after the checkpoint at startup
+            parsed = [self.chain[position] for position in range(self.checkpointed_blocks, len(self.chain))]
+            self.checkpoint_writer.committed(parsed, self.ledger.offsets[self.checkpointed_blocks:], self.ledger.end_offset)
+        self.committer = GroupCommitter(self.ledger, self.blocks_committed)
 
     def create_genesis_block(self):
         return Block(0, time.time(), {"action": "patient_visit", "message": "Genesis block: New patient visit at hospital"}, "0", "hospital_node")
 
     def load_chain_from_file(self):
-        if os.path.exists("blockchain_ledger.json"):
-            with open("blockchain_ledger.json", "r") as f:
-                blocks_data = json.load(f)
-                self.chain = [Block(**block) for block in blocks_data]
-        else:
+        if self.ledger.exists():
+            # Restore the latest checkpoint and parse only the blocks after it,
+            # or parse the whole ledger if there is no matching checkpoint
+            checkpoint = self.checkpoint.load()
+            if checkpoint is not None and self.restore_checkpoint(checkpoint):
+                blocks_data = self.ledger.scan(checkpoint["file_offset"], checkpoint["offsets"])
+            else:
+                self.chain = LazyChain()
+                self.patient_index = PatientIndex()
+                self.incentives = IncentiveLedger()
+                blocks_data = self.ledger.scan()
+            for block in blocks_data:
+                block = Block(**block)
+                self.chain.append(block)
+                self.patient_index.add(block.index, block.data)
+                self.incentives.apply(block.data)
+        if not len(self.chain):
             # If the file does not exist, create the genesis block
             genesis_block = self.create_genesis_block()
             self.chain.append(genesis_block)
             self.save_chain_to_file()  # Save the genesis block to file
+            self.patient_index.add(genesis_block.index, genesis_block.data)
+            self.incentives.apply(genesis_block.data)
+
+    def restore_checkpoint(self, checkpoint):
+        # Adopt the checkpoint if it matches the ledger file; blocks before it
+        # are then parsed only when something asks for them
+        block_count = checkpoint["block_count"]
+        if block_count == 0 or os.path.getsize(self.ledger_file) < checkpoint["file_offset"]:
+            return False
+        if "patients" not in checkpoint["state"] or "incentives" not in checkpoint["state"]:
+            return False  # Written before this state was derived from the chain
+        self.ledger.offsets = checkpoint["offsets"]
+        self.ledger.end_offset = checkpoint["file_offset"]
+        try:
+            tip_hash = self.ledger.read(block_count - 1).get("hash")
+        except ValueError:
+            return False
+        if tip_hash != checkpoint["tip_hash"]:
+            return False
+        self.chain = LazyChain(block_count, lambda position: Block(**self.ledger.read(position)))
+        self.patient_index = PatientIndex.from_state(checkpoint["state"]["patients"])
+        self.incentives = IncentiveLedger.from_state(checkpoint["state"]["incentives"])
+        self.checkpointed_blocks = block_count
+        return True
+
+    def save_checkpoint(self):
+        # Snapshot the committed blocks now rather than at the next
+        # checkpoint_every, e.g. before shutting down
+        self.checkpoint_writer.flush(save=True)
 
     def get_last_block(self):
         return self.chain[-1]
 
     def add_block(self, data, node_id):
-        last_block = self.get_last_block()
-        new_block = Block(last_block.index + 1, time.time(), data, last_block.hash, node_id)
-        self.chain.append(new_block)
-        self.save_chain_to_file()  # Save the updated chain to a file
+        # Link the block to the in-memory tip under the lock, then wait outside
+        # it until the group committer has made the block durable
+        with self.lock:
+            last_block = self.get_last_block()
+            new_block = Block(last_block.index + 1, time.time(), data, last_block.hash, node_id)
+            self.chain.append(new_block)
+            commit = self.committer.submit([new_block])
+        self.committer.wait(commit)
         return new_block
 
+    def receive_blocks(self, blocks_data):
+        # Blocks announced by a peer. Returns True once they are part of the
+        # chain, or False if they do not extend the tip and a sync is needed.
+        blocks = [Block(**block_data) for block_data in blocks_data]
+        with self.lock:
+            new_blocks = []
+            for block in blocks:
+                if block.index < len(self.chain):
+                    if self.chain[block.index].hash != block.hash:
+                        return False
+                else:
+                    new_blocks.append(block)
+            if not new_blocks:
+                return True
+            if not self.valid_blocks(self.get_last_block(), new_blocks):
+                return False
+            for block in new_blocks:
+                self.chain.append(block)
+            commit = self.committer.submit(new_blocks)
+        self.committer.wait(commit)
+        return True
+
+    def adopt_blocks(self, ancestor, blocks):
+        # Replace everything after the first ancestor blocks with a peer's
+        # blocks if the fork rule prefers them: the longer chain wins, and
+        # between equally long chains the one with the lower tip hash.
+        with self.lock:
+            previous = self.chain[ancestor - 1] if ancestor else None
+            if not blocks or ancestor > len(self.chain) or not self.valid_blocks(previous, blocks):
+                return False
+            length = ancestor + len(blocks)
+            if length < len(self.chain) or (length == len(self.chain) and blocks[-1].hash >= self.get_last_block().hash):
+                return False
+            new_blocks = list(blocks)
+            if ancestor < len(self.chain):
+                # Let queued writes land before cutting the file back
+                self.committer.wait(self.committer.submitted)
+                self.version += 1
+                dropped = [self.chain[position] for position in range(ancestor, len(self.chain))]
+                self.committed_length = ancestor
+                self.committer.truncate(ancestor)
+                self.checkpoint_writer.truncated(ancestor, dropped, self.ledger.end_offset,
+                                                 self.chain[ancestor - 1].hash if ancestor else None)
+                self.chain.truncate(ancestor)
+                self.patient_index.truncate(ancestor, dropped)
+                for block in reversed(dropped):
+                    self.incentives.revert(block.data)
+                for block in blocks:
+                    self.chain.append(block)
+                # Every record on the losing fork was confirmed to some client,
+                # so the ones the new chain lacks go on top of the new tip. They
+                # keep their timestamp and author so they are recognised if they
+                # show up again on another fork.
+                recorded = {self.record_key(block) for block in blocks}
+                for block in dropped:
+                    key = self.record_key(block)
+                    if block.index == 0 or key in recorded or self.has_record(key, block.data, ancestor):
+                        continue
+                    recorded.add(key)
+                    last_block = self.get_last_block()
+                    new_block = Block(last_block.index + 1, block.timestamp, block.data, last_block.hash, block.node_id)
+                    self.chain.append(new_block)
+                    new_blocks.append(new_block)
+                commit = self.committer.submit(new_blocks)
+                # Readers keep retrying until the new blocks are durable and
+                # indexed, so a confirmed record never appears to be missing
+                try:
+                    self.committer.wait(commit)
+                finally:
+                    self.version += 1
+                return True
+            for block in blocks:
+                self.chain.append(block)
+            commit = self.committer.submit(new_blocks)
+        self.committer.wait(commit)
+        return True
+
+    def has_record(self, key, data, end):
+        # Whether one of the first end blocks holds the record with this key;
+        # only the blocks of the record's patient are compared
+        patient_id = data.get("patient_id") if isinstance(data, dict) else None
+        positions = self.patient_index.positions(patient_id) if patient_id is not None else range(1, end)
+        return any(position < end and self.record_key(self.chain[position]) == key for position in positions)
+
+    def record_key(self, block):
+        return block.timestamp, block.node_id, json.dumps(block.data, sort_keys=True)
+
+    def valid_blocks(self, previous, blocks):
+        # Check that blocks follow previous (None before genesis) and that
+        # every hash matches the block's contents
+        for block in blocks:
+            expected_index = previous.index + 1 if previous is not None else 0
+            expected_hash = previous.hash if previous is not None else "0"
+            if block.index != expected_index or block.previous_hash != expected_hash:
+                return False
+            if block.calculate_hash() != block.hash:
+                return False
+            previous = block
+        return True
+
+    def blocks_committed(self, blocks):
+        # Called by the group committer once a batch of blocks is on disk
+        for block in blocks:
+            self.patient_index.add(block.index, block.data)
+            self.incentives.apply(block.data)
+        self.committed_length += len(blocks)
+        self.checkpoint_writer.committed(blocks, self.ledger.offsets[-len(blocks):], self.ledger.end_offset)
+
     def save_chain_to_file(self):
-        with open("blockchain_ledger.json", "w") as f:
-            json.dump([block.__dict__ for block in self.chain], f, indent=4)
+        # Append the blocks not yet in the file; earlier blocks are never rewritten
+        stored = len(self.ledger.offsets)
+        self.ledger.append([self.chain[position].__dict__ for position in range(stored, len(self.chain))])
+
+    def read_committed(self, start=0, limit=None):
+        # Durable blocks from start on, read without the lock; the read starts
+        # over if a fork switch replaced blocks meanwhile. Returns the committed
+        # length along with the blocks.
+        while True:
+            version = self.version
+            length = self.committed_length
+            end = length if limit is None else min(length, start + limit)
+            try:
+                blocks = [self.chain[position] for position in range(start, end)]
+            except IndexError:
+                blocks = None
+            if blocks is not None and version % 2 == 0 and version == self.version:
+                return length, blocks
+            time.sleep(0.001)
 
     def get_full_chain(self):
         return {
             "status": "success",
-            "chain": [block.__dict__ for block in self.chain]
+            "chain": [block.__dict__ for block in self.read_committed()[1]]
+        }
+
+    def get_headers(self, start, limit):
+        # Everything but the block data, for peers deciding what to fetch
+        length, blocks = self.read_committed(start, limit)
+        return {
+            "status": "success",
+            "length": length,
+            "headers": [{key: value for key, value in block.__dict__.items() if key != "data"} for block in blocks]
         }
 
-# Global user data
+    def read_patient_records(self, patient_id, action=None, start=0, limit=None):
+        # One patient's committed blocks, oldest first, optionally only those of
+        # one action; a negative start counts from the newest record. Returns
+        # the patient's total record count along with the blocks.
+        while True:
+            version = self.version
+            positions = self.patient_index.positions(patient_id, action)
+            total = len(positions)
+            first = max(total + start, 0) if start < 0 else start
+            selected = positions[first:] if limit is None else positions[first:first + limit]
+            try:
+                blocks = [self.chain[position] for position in selected]
+            except IndexError:
+                blocks = None
+            if blocks is not None and version % 2 == 0 and version == self.version:
+                return total, blocks
+            time.sleep(0.001)
+
+    def get_patient_history(self, patient_id, action=None, start=0, limit=50):
+        total, blocks = self.read_patient_records(patient_id, action, start, limit)
+        return {
+            "status": "success",
+            "patient_id": patient_id,
+            "total": total,
+            "start": start,
+            "records": [block.__dict__ for block in blocks]
+        }
+
+    def get_latest_record(self, patient_id, action=None):
+        blocks = self.read_patient_records(patient_id, action, -1)[1]
+        if not blocks:
+            return {"status": "failure", "message": "No records found for this patient."}
+        return {"status": "success", "record": blocks[0].__dict__}
+
+    def get_bodies(self, start, limit):
+        return {
+            "status": "success",
+            "bodies": [block.data for block in self.read_committed(start, limit)[1]]
+        }
+
+# Global user data; "role" decides what a user may write and read, and users
+# with "wallet" earn incentives, paid out by each node's chain
+# Passwords are stored as salted PBKDF2 hashes (the demo passwords are
+# unchanged: doc123, diag123, pharm123, hosp123 and pat123)
 users = {
-    "doctor": {"password": "doc123", "balance": 0},
-    "diagnostic": {"password": "diag123", "balance": 0},
-    "pharmacy": {"password": "pharm123", "balance": 0},
-    "hospital": {"password": "hosp123"},
-    "patient1": {"patient_id": "patient1", "password": "pat123"},  # Example patient
+    "doctor": {"role": "doctor", "password_hash": "pbkdf2_sha256$600000$d820e23528d73ab8363a506206e2e996$d8d5b5fda2f79978d33045c72cf67708576b008ff9f6337c3871268740c4af7a", "wallet": True},
+    "diagnostic": {"role": "diagnostic", "password_hash": "pbkdf2_sha256$600000$308172c0224c410666d2044436ed85b9$895a084ce79889744371bdfc347efe627b9f566b2362495cf55bcf8ac21df761", "wallet": True},
+    "pharmacy": {"role": "pharmacy", "password_hash": "pbkdf2_sha256$600000$f3e7dbba2210627b8906fd5da376179d$63e61c08446cc9611a4a7db6657da411f28a673bc3a1c2bd0f63b3bd99b5d145", "wallet": True},
+    "hospital": {"role": "hospital", "password_hash": "pbkdf2_sha256$600000$28fe79ec2829b0863d1c027109ad8e2c$4bc225909a6fc3b7852972553b000a053b0e35ac1f51dd66170e01c6e865c6cd"},
+    "patient1": {"role": "patient", "patient_id": "patient1", "password_hash": "pbkdf2_sha256$600000$1dc17f5cce7cf8fe650e45c303900bee$8428e84ff08a28f062d0d4603d92aaa18e470077c617fd795564b13f558f19ca"},  # Example patient
 }
 
-# Lock for accessing and modifying the blockchain and user data
-blockchain_lock = threading.Lock()
+# Lock for accessing and modifying the user data (the blockchain has its own)
 user_data_lock = threading.Lock()
 
+# Login tokens, valid on every node; the password hash is only checked at login
+sessions = SessionCache()
+
+# Actions that need a token from login
+AUTHENTICATED_ACTIONS = {"add_block", "get_chain", "get_balance", "get_patient_history", "get_latest_record"}
+
+# Replication actions, only served to nodes presenting the shared peer secret
+PEER_ACTIONS = {"announce_blocks", "get_headers", "get_bodies"}
+
+# Roles that may read every patient's records; patients only read their own
+STAFF_ROLES = {"doctor", "diagnostic", "pharmacy", "hospital"}
+
+# Record type -> (role allowed to write it, field of the record that must name
+# the writer, or None). The named user is the one the record pays.
+RECORD_WRITERS = {
+    "blood_test": ("doctor", "doctor"),
+    "prescription": ("doctor", "doctor"),
+    "report": ("diagnostic", "diagnostic"),
+    "medicine_purchase": ("pharmacy", "pharmacy"),
+    "patient_visit": ("hospital", None),
+}
+
 # =============================================================================
 # Node Server to Handle Logins, Blockchain Operations, and Incentives
 # =============================================================================
 
 class NodeServer(threading.Thread):
-    def __init__(self, host, port, node_id):
+    sync_page_size = 500  # Headers or bodies fetched from a peer per request
+    max_page_size = 1000  # Most headers, bodies or patient records served per request
+    history_page_size = 50  # Patient records returned per request by default
+
+    # core="selector" serves every connection from one event loop with a fixed
+    # pool of handler threads; core="threads" starts a thread per connection.
+    # New blocks are announced to the peers, (host, port) pairs of the other
+    # nodes, and the chain is synced with them every sync_interval seconds.
+    # Nodes prove to each other that they are peers with peer_secret; without
+    # one, replication requests are refused.
+    def __init__(self, host, port, node_id, core="selector", backlog=1024, max_connections=10000,
+                 workers=8, queue_size=1024, idle_timeout=300, ledger_file=None, peers=(),
+                 sync_interval=5, peer_secret=None):
         threading.Thread.__init__(self)
         self.host = host
         self.port = port
         self.node_id = node_id
-        self.blockchain = Blockchain()
+        self.core = core
+        self.max_connections = max_connections
+        self.workers = workers
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout  # Seconds a persistent client connection may sit idle
+        self.peers = [tuple(peer) for peer in peers]
+        self.sync_interval = sync_interval
+        self.peer_secret = peer_secret
+        self.announcements = queue.Queue()  # Blocks added here and not yet sent to the peers
+        self.sync_requests = queue.Queue()  # Peers that announced blocks we could not attach
+        self.blockchain = Blockchain(ledger_file, node_id)
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((host, port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(backlog)
         print(f"{self.node_id} Node Server running on {host}:{port}")
 
     def run(self):
+        if self.peers:
+            threading.Thread(target=self.announce_blocks, daemon=True).start()
+            threading.Thread(target=self.sync_peers, daemon=True).start()
+        if self.core == "selector":
+            SelectorServerCore(self.server_socket, self.handle_request, workers=self.workers,
+                               queue_size=self.queue_size, max_connections=self.max_connections,
+                               idle_timeout=self.idle_timeout).serve_forever()
+            return
         while True:
             client, address = self.server_socket.accept()
             threading.Thread(target=self.handle_client, args=(client, address)).start()
 
     def handle_client(self, client, address):
+        # Serve framed requests on one connection until the client closes it
+        client.settimeout(self.idle_timeout)
         try:
-            data = client.recv(4096).decode()
-            if not data:
-                client.close()
-                return
+            while True:
+                request = recv_frame(client)
+                if request is None:
+                    break
+                send_frame(client, self.handle_request(request))
+        except (OSError, ProtocolError, ValueError):
+            pass  # Client went away, timed out or sent a malformed frame
+        finally:
+            client.close()
 
-            request = json.loads(data)
+    def handle_request(self, request):
+        if not isinstance(request, dict):
+            return {"status": "error", "message": "Request must be a JSON object.", "id": None}
+        try:
             response = {}
+            username = sessions.validate(request.get("token")) if request["action"] in AUTHENTICATED_ACTIONS else None
 
             if request["action"] == "login":
                 username = request["username"]
                 password = request["password"]
+                with user_data_lock:
+                    password_hash = users[username]["password_hash"] if username in users else None
+                # The slow hash runs once here; later requests only present the token
+                valid = password_hash is not None and verify_password(password, password_hash)
 
                 # Check if the user is a patient
                 if username.startswith("patient"):
-                    if username in users and users[username]["password"] == password:
+                    if valid:
                         response["status"] = "success"
                         response["message"] = f"{username} logged in successfully."
                     else:
@@ -119,79 +446,214 @@ class NodeServer(threading.Thread):
                         response["message"] = "Invalid patient ID or password."
                 else:
                     # Existing login logic for doctors, diagnostics, and pharmacies
-                    if username in users and users[username]["password"] == password:
+                    if valid:
                         response["status"] = "success"
                         response["message"] = f"{username} logged in successfully."
                     else:
                         response["status"] = "failure"
                         response["message"] = "Invalid credentials."
+                if valid:
+                    response["token"] = sessions.create(username)
+                    response["expires_in"] = sessions.ttl
+
+            elif request["action"] == "logout":
+                sessions.revoke(request.get("token"))
+                response["status"] = "success"
+
+            elif request["action"] in AUTHENTICATED_ACTIONS and username is None:
+                response["status"] = "failure"
+                response["message"] = "Login required: missing, invalid or expired token."
+
+            elif request["action"] in AUTHENTICATED_ACTIONS and not self.is_allowed(username, request):
+                response["status"] = "failure"
+                response["message"] = f"{username} is not allowed to do this."
+
+            elif request["action"] in PEER_ACTIONS and not self.is_peer(request):
+                response["status"] = "failure"
+                response["message"] = "Replication requests need the peer secret."
 
             elif request["action"] == "add_block":
-                with blockchain_lock:
-                    block_data = request["data"]
-                    new_block = self.blockchain.add_block(block_data, self.node_id)
-
-                    # Incentive updates
-                    with user_data_lock:
-                        if block_data.get("action") == "blood_test":
-                            doctor = block_data.get("doctor")
-                            if doctor in users:
-                                users[doctor]["balance"] += 10
-                        elif block_data.get("action") == "report":
-                            diagnostic = block_data.get("diagnostic")
-                            if diagnostic in users:
-                                users[diagnostic]["balance"] += 5
-                        elif block_data.get("action") == "prescription":
-                            doctor = block_data.get("doctor")
-                            if doctor in users:
-                                users[doctor]["balance"] += 5
-                        elif block_data.get("action") == "medicine_purchase":
-                            pass
+                block_data = request["data"]
+                # Incentives are paid by the chain itself once the block commits
+                new_block = self.blockchain.add_block(block_data, self.node_id)  # Returns once durable
+                if self.peers:
+                    self.announcements.put(new_block)
 
-                    response["status"] = "success"
-                    response["message"] = f"Block added by {self.node_id} with index {new_block.index}."
+                response["status"] = "success"
+                response["message"] = f"Block added by {self.node_id} with index {new_block.index}."
 
             elif request["action"] == "get_chain":
-                with blockchain_lock:
-                    response = self.blockchain.get_full_chain()
+                response = self.blockchain.get_full_chain()
+
+            elif request["action"] == "announce_blocks":
+                if self.blockchain.receive_blocks(request["blocks"]):
+                    response["status"] = "success"
+                else:
+                    # Behind or on another fork: fetch what is missing from the announcer
+                    self.sync_requests.put(tuple(request["peer"]))
+                    response["status"] = "syncing"
+
+            elif request["action"] == "get_headers":
+                limit = min(request.get("limit", self.sync_page_size), self.max_page_size)
+                response = self.blockchain.get_headers(request["start"], limit)
+
+            elif request["action"] == "get_bodies":
+                limit = min(request.get("limit", self.sync_page_size), self.max_page_size)
+                response = self.blockchain.get_bodies(request["start"], limit)
+
+            elif request["action"] == "get_patient_history":
+                limit = min(request.get("limit", self.history_page_size), self.max_page_size)
+                response = self.blockchain.get_patient_history(request["patient_id"], request.get("record_action"),
+                                                               request.get("start", 0), limit)
+
+            elif request["action"] == "get_latest_record":
+                response = self.blockchain.get_latest_record(request["patient_id"], request.get("record_action"))
 
             elif request["action"] == "get_balance":
                 user = request.get("user")
                 with user_data_lock:
-                    if user in users and "balance" in users[user]:
-                        response["status"] = "success"
-                        response["balance"] = users[user]["balance"]
-                    else:
-                        response["status"] = "failure"
-                        response["message"] = "User not found or no balance attribute."
-
-            client.send(json.dumps(response).encode())
+                    has_wallet = user in users and users[user].get("wallet")
+                if has_wallet:
+                    response["status"] = "success"
+                    response["balance"] = self.blockchain.incentives.get_balance(user)
+                else:
+                    response["status"] = "failure"
+                    response["message"] = "User not found or no balance attribute."
 
         except Exception as e:
-            error_response = {"status": "error", "message": str(e)}
-            client.send(json.dumps(error_response).encode())
-        finally:
-            client.close()
+            response = {"status": "error", "message": str(e)}
+        response["id"] = request.get("id")  # Lets the client match pipelined responses
+        return response
+
+    def announce_blocks(self):
+        # Send new blocks to every peer, batching whatever queued up meanwhile
+        while True:
+            blocks = [self.announcements.get()]
+            while True:
+                try:
+                    blocks.append(self.announcements.get_nowait())
+                except queue.Empty:
+                    break
+            request = {
+                "action": "announce_blocks",
+                "blocks": [block.__dict__ for block in blocks],
+                "peer": [self.host, self.port],
+                "peer_secret": self.peer_secret,
+            }
+            for host, port in self.peers:
+                try:
+                    connection_pool.request(host, port, request)
+                except (OSError, ProtocolError, ValueError):
+                    pass  # The peer catches up on its next periodic sync
+
+    def sync_peers(self):
+        # Sync with peers that asked for it, and with all of them periodically
+        while True:
+            try:
+                peers = [self.sync_requests.get(timeout=self.sync_interval)]
+            except queue.Empty:
+                peers = self.peers
+            for peer in peers:
+                try:
+                    self.sync_with(peer)
+                except (OSError, ProtocolError, ValueError, KeyError, TypeError):
+                    pass  # Peer unreachable or changed its chain mid-sync; try again later
+
+    def sync_with(self, peer):
+        # Headers first: find the last block both chains share, then fetch the
+        # bodies of only the blocks after it and let the fork rule decide
+        host, port = peer
+        length = self.blockchain.committed_length
+        start = max(length - 1, 0)
+        step = 1
+        while True:
+            response = connection_pool.request(host, port, {"action": "get_headers", "start": start,
+                                                            "limit": self.sync_page_size, "peer_secret": self.peer_secret})
+            peer_length, headers = response["length"], response["headers"]
+            if peer_length < length:
+                return
+            if peer_length == length and start == length - 1 and headers[0]["hash"] >= self.blockchain.get_last_block().hash:
+                return  # Same chain, or an equally long fork that loses the tie
+            if start == 0 or self.shares_block(headers[0]):
+                break
+            # Step back further each time so a deep fork costs few requests
+            start = max(start - step, 0)
+            step *= 2
+
+        ancestor = start
+        new_headers = []
+        while True:
+            for header in headers:
+                if not new_headers and self.shares_block(header):
+                    ancestor = header["index"] + 1
+                else:
+                    new_headers.append(header)
+            if not headers or headers[-1]["index"] + 1 >= peer_length:
+                break
+            response = connection_pool.request(host, port, {"action": "get_headers", "start": headers[-1]["index"] + 1,
+                                                            "limit": self.sync_page_size, "peer_secret": self.peer_secret})
+            headers = response["headers"]
+        if not new_headers:
+            return
+
+        blocks = []
+        while len(blocks) < len(new_headers):
+            response = connection_pool.request(host, port, {"action": "get_bodies", "start": ancestor + len(blocks),
+                                                            "limit": self.sync_page_size, "peer_secret": self.peer_secret})
+            if not response["bodies"]:
+                return
+            for body in response["bodies"]:
+                if len(blocks) < len(new_headers):
+                    blocks.append(Block(data=body, **new_headers[len(blocks)]))
+        self.blockchain.adopt_blocks(ancestor, blocks)
+
+    def shares_block(self, header):
+        # Whether our committed chain has this exact block
+        index = header["index"]
+        length, blocks = self.blockchain.read_committed(index, 1)
+        return index < length and blocks[0].hash == header["hash"]
 
     def get_user_role(self, username):
-        if username in users:
-            for role, data in users.items():
-                if username == role:
-                    return role
-        return None
+        with user_data_lock:
+            return users[username].get("role") if username in users else None
+
+    def is_allowed(self, username, request):
+        # Whether the logged-in user may make this request: records are only
+        # written by their role, in the writer's own name, and patients only
+        # read their own records
+        role = self.get_user_role(username)
+        action = request["action"]
+        if action == "add_block":
+            data = request.get("data")
+            if not isinstance(data, dict) or data.get("action") not in RECORD_WRITERS:
+                return False
+            writer_role, field = RECORD_WRITERS[data["action"]]
+            return role == writer_role and (field is None or data.get(field) == username)
+        if action in ("get_patient_history", "get_latest_record"):
+            if role in STAFF_ROLES:
+                return True
+            with user_data_lock:
+                patient_id = users.get(username, {}).get("patient_id")
+            return patient_id is not None and str(request.get("patient_id")) == patient_id
+        if action == "get_balance":
+            return request.get("user") == username
+        return role in STAFF_ROLES
+
+    def is_peer(self, request):
+        presented = request.get("peer_secret")
+        return (self.peer_secret is not None and isinstance(presented, str)
+                and hmac.compare_digest(presented.encode(), self.peer_secret.encode()))
 
 # =============================================================================
 # Client Utility Function to Interact with the Node
 # =============================================================================
 
+# Persistent connections shared by every request this process sends
+connection_pool = ConnectionPool()
+
 def send_request(host, port, request):
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((host, port))
-        s.send(json.dumps(request).encode())
-        response = s.recv(4096).decode()
-        s.close()
-        return json.loads(response)
+        return connection_pool.request(host, port, request)
     except ConnectionRefusedError:
         print(f"Error: Could not connect to the node at {host}:{port}. Make sure the server is running.")
         return {"status": "error", "message": "Connection refused"}
@@ -207,13 +669,21 @@ def main():
     central_node_host = "127.0.0.1"
     central_node_port = 5000
 
-    # Start the distributed node servers
-    nodes = {
-        "doctor": NodeServer(central_node_host, central_node_port + 1, "doctor_node"),
-        "diagnostic": NodeServer(central_node_host, central_node_port + 2, "diagnostic_node"),
-        "pharmacy": NodeServer(central_node_host, central_node_port + 3, "pharmacy_node"),
-        "hospital": NodeServer(central_node_host, central_node_port + 4, "hospital_node"),
+    # Start the distributed node servers, each with its own ledger file and
+    # the other nodes as replication peers. Nodes in other processes join
+    # with the same PEER_SECRET.
+    peer_secret = os.environ.get("PEER_SECRET") or secrets.token_hex(32)
+    addresses = {
+        "doctor": (central_node_host, central_node_port + 1),
+        "diagnostic": (central_node_host, central_node_port + 2),
+        "pharmacy": (central_node_host, central_node_port + 3),
+        "hospital": (central_node_host, central_node_port + 4),
     }
+    nodes = {}
+    for role, (host, port) in addresses.items():
+        peers = [address for other, address in addresses.items() if other != role]
+        nodes[role] = NodeServer(host, port, f"{role}_node", ledger_file=f"{role}_node_ledger.json", peers=peers,
+                                 peer_secret=peer_secret)
 
     for node in nodes.values():
         node.daemon = True
@@ -244,6 +714,7 @@ def main():
         patient_id = input("Enter patient ID for the blood test: ")
         blood_test_req = {
             "action": "add_block",
+            "token": doctor_login_response["token"],
             "data": {
                 "action": "blood_test",
                 "patient_id": patient_id,
@@ -271,6 +742,7 @@ def main():
         patient_id = input("Enter patient ID for the report: ")
         blood_report_req = {
             "action": "add_block",
+            "token": diag_login_response["token"],
             "data": {
                 "action": "report",
                 "patient_id": patient_id,
@@ -288,6 +760,7 @@ def main():
         patient_id = input("Enter patient ID for the prescription: ")
         prescription_req = {
             "action": "add_block",
+            "token": doctor_login_response["token"],
             "data": {
                 "action": "prescription",
                 "patient_id": patient_id,
@@ -315,6 +788,7 @@ def main():
         patient_id = input("Enter patient ID for medicine purchase: ")
         medicine_purchase_req = {
             "action": "add_block",
+            "token": pharm_login_response["token"],
             "data": {
                 "action": "medicine_purchase",
                 "patient_id": patient_id,
@@ -347,15 +821,20 @@ def main():
     # -----------------------------------------------------------------------------
     print("\n--- Current Blockchain Ledger ---")
     # Request the chain from the pharmacy node (port 5003) to see all blocks added in this simulation.
-    get_chain_req = {"action": "get_chain"}
+    get_chain_req = {"action": "get_chain", "token": pharm_login_response.get("token")}
     chain_response = send_request(central_node_host, central_node_port + 3, get_chain_req)
     print(json.dumps(chain_response, indent=4))
 
+    print("\n--- Patient History ---")
+    # Only this patient's records, served from the doctor node's patient index
+    history_req = {"action": "get_patient_history", "patient_id": patient_id, "token": patient_login_response.get("token")}
+    print(json.dumps(send_request(central_node_host, central_node_port + 1, history_req), indent=4))
+
     print("\n--- Incentive Balances ---")
-    balance_req_doctor = {"action": "get_balance", "user": doctor_username}
+    balance_req_doctor = {"action": "get_balance", "user": doctor_username, "token": doctor_login_response.get("token")}
     print(f"Doctor ({doctor_username}) balance:", send_request(central_node_host, central_node_port + 1, balance_req_doctor))
 
-    balance_req_diag = {"action": "get_balance", "user": diag_username}
+    balance_req_diag = {"action": "get_balance", "user": diag_username, "token": diag_login_response.get("token")}
     print(f"Diagnostic center ({diag_username}) balance:", send_request(central_node_host, central_node_port + 2, balance_req_diag))
 
     # Keep the main thread alive to allow the node servers to continue running
@@ -364,6 +843,8 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         print("Stopping the nodes...")
+        for node in nodes.values():
+            node.blockchain.save_checkpoint()
 
 if __name__ == "__main__":
     main()
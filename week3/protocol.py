@@ -0,0 +1,197 @@
+import itertools
+import json
+import socket
+import struct
+import threading
+import zlib
+
+# Every message is one frame: a header with the payload length and encoding,
+# followed by the payload. Frames let a connection carry any number of
+# messages of any size, instead of one recv(4096) per connection.
+FRAME_HEADER = struct.Struct(">IB")
+ENCODING_JSON = 0
+ENCODING_ZLIB_JSON = 1  # Compact encoding used for large payloads such as full chains
+COMPRESS_THRESHOLD = 16 * 1024
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# The node closed the connection before reading or answering any request on
+# it, so the requests can safely be sent again on a new connection.
+class StaleConnectionError(ConnectionError):
+    pass
+
+
+def encode_frame(message):
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    encoding = ENCODING_JSON
+    if len(payload) > COMPRESS_THRESHOLD:
+        payload = zlib.compress(payload)
+        encoding = ENCODING_ZLIB_JSON
+    return FRAME_HEADER.pack(len(payload), encoding) + payload
+
+
+def decode_payload(encoding, payload):
+    if encoding == ENCODING_ZLIB_JSON:
+        # MAX_FRAME_SIZE also bounds the decompressed size, so a small frame
+        # cannot expand into gigabytes
+        decompressor = zlib.decompressobj()
+        try:
+            payload = decompressor.decompress(payload, MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ProtocolError(f"Corrupt compressed frame: {e}")
+        if decompressor.unconsumed_tail:
+            raise ProtocolError(f"Decompressed frame exceeds {MAX_FRAME_SIZE} bytes")
+    elif encoding != ENCODING_JSON:
+        raise ProtocolError(f"Unknown frame encoding {encoding}")
+    return json.loads(payload)
+
+
+def recv_exact(sock, size):
+    # Read exactly size bytes; None if the peer closed before sending anything.
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("Connection closed in the middle of a frame")
+        received += count
+    return bytes(buffer)
+
+
+def send_frame(sock, message):
+    sock.sendall(encode_frame(message))
+
+
+def recv_frame(sock):
+    # Read one message; None when the peer closed the connection cleanly.
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    length, encoding = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the limit")
+    payload = recv_exact(sock, length) if length else b""
+    if payload is None:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return decode_payload(encoding, payload)
+
+
+# Incremental frame decoder for non-blocking sockets: feed it whatever bytes
+# arrived and it returns the messages completed so far.
+class FrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            length, encoding = FRAME_HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {length} bytes exceeds the limit")
+            end = FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            messages.append(decode_payload(encoding, bytes(self.buffer[FRAME_HEADER.size:end])))
+            del self.buffer[:end]
+        return messages
+
+
+# Long-lived client connection. Every request gets an id that the server
+# echoes back, so several requests can be sent before reading the responses.
+class Connection:
+    def __init__(self, host, port, timeout=10):
+        self.address = (host, port)
+        self.sock = socket.create_connection(self.address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.ids = itertools.count(1)
+        self.used = False  # Whether a request has completed on this connection
+
+    def pipeline(self, requests):
+        # Send all requests, then collect the responses and return them in request order.
+        ids = []
+        frames = []
+        for request in requests:
+            request_id = next(self.ids)
+            ids.append(request_id)
+            frames.append(encode_frame(dict(request, id=request_id)))
+        try:
+            self.sock.sendall(b"".join(frames))
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise StaleConnectionError(str(e)) from e
+        responses = {}
+        while len(responses) < len(ids):
+            response = recv_frame(self.sock)
+            if response is None and not responses:
+                raise StaleConnectionError("Connection closed by the node")
+            if response is None:
+                raise ConnectionError("Connection closed by the node")
+            responses[response.get("id")] = response
+        self.used = True
+        return [responses[request_id] for request_id in ids]
+
+    def request(self, request):
+        return self.pipeline([request])[0]
+
+    def close(self):
+        self.sock.close()
+
+
+# Pool of idle connections per node, replacing a fresh TCP connection per request.
+class ConnectionPool:
+    def __init__(self, max_idle=8, timeout=10):
+        self.max_idle = max_idle  # Idle connections kept per node
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def pipeline(self, host, port, requests):
+        connection = self._acquire(host, port)
+        try:
+            try:
+                responses = connection.pipeline(requests)
+            except StaleConnectionError:
+                if not connection.used:
+                    raise
+                # The node closed a connection that sat idle in the pool; retry
+                # once on a fresh connection
+                connection.close()
+                connection = Connection(host, port, self.timeout)
+                responses = connection.pipeline(requests)
+        except Exception:
+            connection.close()
+            raise
+        self._release(connection)
+        return responses
+
+    def request(self, host, port, request):
+        return self.pipeline(host, port, [request])[0]
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+    def _acquire(self, host, port):
+        with self.lock:
+            connections = self.idle.get((host, port))
+            if connections:
+                return connections.pop()
+        return Connection(host, port, self.timeout)
+
+    def _release(self, connection):
+        with self.lock:
+            connections = self.idle.setdefault(connection.address, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
@@ -0,0 +1,221 @@
+import collections
+import queue
+import selectors
+import socket
+import threading
+import time
+
+from protocol import FrameDecoder, ProtocolError, encode_frame
+
+READ_SIZE = 65536
+MAX_OUTPUT_BUFFER = 4 * 1024 * 1024  # Stop reading from a client whose responses pile up unread
+
+
+class _Client:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.decoder = FrameDecoder()
+        self.output = bytearray()
+        self.pending = collections.deque()  # Requests waiting for room in the work queue
+        self.in_flight = 0  # Requests handed to workers and not yet answered
+        self.events = 0  # Selector events currently registered for the socket
+        self.last_active = time.monotonic()
+        self.closed = False
+
+
+# Event-loop server core: one selector thread does all socket I/O for every
+# connection, and a fixed pool of workers runs the request handlers. The work
+# queue is bounded; when it is full, the loop stops reading from clients until
+# the workers catch up, and it stops accepting once max_connections are open.
+class SelectorServerCore:
+    def __init__(self, server_socket, handle_request, workers=8, queue_size=1024,
+                 max_connections=10000, idle_timeout=300):
+        self.server_socket = server_socket
+        self.handle_request = handle_request
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.selector = selectors.DefaultSelector()
+        self.work = queue.Queue(maxsize=queue_size)
+        self.done = collections.deque()  # (client, response frame) pairs from the workers
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_writer.setblocking(False)
+        self.clients = set()
+        self.waiting = set()  # Clients with requests held back by a full work queue
+        self.accepting = False
+        self.running = True
+        self.next_expiry_check = 0.0
+        self.workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+
+    def serve_forever(self):
+        self.server_socket.setblocking(False)
+        self.wakeup_reader.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self._set_accepting(True)
+        for worker in self.workers:
+            worker.start()
+        while self.running:
+            for key, events in self.selector.select(timeout=1.0):
+                if key.fileobj is self.server_socket:
+                    self._accept()
+                elif key.fileobj is self.wakeup_reader:
+                    self._drain_wakeups()
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(client)
+                    if events & selectors.EVENT_WRITE and not client.closed:
+                        self._write(client)
+            self._finish_responses()
+            if time.monotonic() >= self.next_expiry_check:
+                self._expire_idle()
+                self.next_expiry_check = time.monotonic() + 1.0
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def _set_accepting(self, accepting):
+        if accepting and not self.accepting:
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
+        elif not accepting and self.accepting:
+            self.selector.unregister(self.server_socket)
+        self.accepting = accepting
+
+    def _accept(self):
+        while len(self.clients) < self.max_connections:
+            try:
+                sock, address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(sock, address)
+            self.clients.add(client)
+            self._update_interest(client)
+        # At the limit: leave further connections in the listen backlog
+        self._set_accepting(False)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client)
+            return
+        client.last_active = time.monotonic()
+        try:
+            client.pending.extend(client.decoder.feed(data))
+        except (ProtocolError, ValueError):
+            self._close(client)
+            return
+        self._dispatch(client)
+
+    def _dispatch(self, client):
+        while client.pending:
+            try:
+                self.work.put_nowait((client, client.pending[0]))
+            except queue.Full:
+                break
+            client.pending.popleft()
+            client.in_flight += 1
+        if client.pending:
+            self.waiting.add(client)
+        else:
+            self.waiting.discard(client)
+        self._update_interest(client)
+
+    def _update_interest(self, client):
+        if client.closed:
+            return
+        events = 0
+        # Backpressure: only read more once earlier requests have been queued
+        # and the client is keeping up with its responses
+        if not client.pending and len(client.output) < MAX_OUTPUT_BUFFER:
+            events |= selectors.EVENT_READ
+        if client.output:
+            events |= selectors.EVENT_WRITE
+        if events == client.events:
+            return
+        # A paused client with nothing to send is taken out of the selector
+        # until a worker's response or freed queue space brings it back
+        if not events:
+            self.selector.unregister(client.sock)
+        elif not client.events:
+            self.selector.register(client.sock, events, client)
+        else:
+            self.selector.modify(client.sock, events, client)
+        client.events = events
+
+    def _worker(self):
+        while True:
+            client, request = self.work.get()
+            try:
+                frame = encode_frame(self.handle_request(request))
+            except Exception as e:
+                # Nothing about the request is trusted here; an exception
+                # escaping this loop would cost the server a worker
+                frame = encode_frame({"status": "error", "message": str(e), "id": None})
+            self.done.append((client, frame))
+            self._wake()
+
+    def _wake(self):
+        try:
+            self.wakeup_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # A wakeup is already pending
+
+    def _drain_wakeups(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _finish_responses(self):
+        touched = set()
+        while self.done:
+            client, frame = self.done.popleft()
+            client.in_flight -= 1
+            if not client.closed:
+                client.output += frame
+                touched.add(client)
+        for client in touched:
+            self._write(client)
+        # Workers freed queue space; move waiting requests along
+        for client in list(self.waiting):
+            self._dispatch(client)
+
+    def _write(self, client):
+        if client.output:
+            try:
+                sent = client.sock.send(client.output)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self._close(client)
+                return
+            del client.output[:sent]
+            client.last_active = time.monotonic()
+        self._update_interest(client)
+
+    def _expire_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for client in list(self.clients):
+            if client.last_active < deadline and not client.in_flight and not client.pending:
+                self._close(client)
+
+    def _close(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self.clients.discard(client)
+        self.waiting.discard(client)
+        if client.events:
+            self.selector.unregister(client.sock)
+        client.sock.close()
+        if not self.accepting and len(self.clients) < self.max_connections:
+            self._set_accepting(True)
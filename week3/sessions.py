@@ -0,0 +1,70 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+PBKDF2_ITERATIONS = 600000  # Makes every guess slow; only paid at login
+
+
+def hash_password(password, salt=None, iterations=PBKDF2_ITERATIONS):
+    # Stored as "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>"
+    salt = salt if salt is not None else os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    try:
+        algorithm, iterations, salt, expected = stored.split("$")
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != "pbkdf2_sha256":
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+# Tokens issued at login, checked on every later request. Every session lives
+# for the same ttl, so insertion order is expiry order and expired sessions
+# are dropped from the front.
+class SessionCache:
+    def __init__(self, ttl=3600, max_sessions=100000):
+        self.ttl = ttl  # Seconds a token stays valid
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # token -> (username, expiry time)
+        self.lock = threading.Lock()
+
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self._evict(time.monotonic())
+            if len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)  # Oldest session goes first
+            self.sessions[token] = (username, time.monotonic() + self.ttl)
+        return token
+
+    def validate(self, token):
+        # The username the token belongs to, or None if unknown or expired
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        username, expires = session
+        if time.monotonic() >= expires:
+            with self.lock:
+                self.sessions.pop(token, None)
+            return None
+        return username
+
+    def revoke(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def _evict(self, now):
+        while self.sessions:
+            token, (username, expires) = next(iter(self.sessions.items()))
+            if expires > now:
+                break
+            del self.sessions[token]
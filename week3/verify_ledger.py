@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from prog import Block
+
+CHUNK_BYTES = 16 * 1024 * 1024  # Bytes of ledger each worker verifies at a time
+
+_decoder = json.JSONDecoder()
+
+
+# Verifies blockchain_ledger.json (or a node's own ledger) without loading it
+# whole: the file is cut into byte ranges at block boundaries, a process pool
+# recomputes the hashes inside each range, and the links between ranges are
+# checked in order. Unlike loading the chain, nothing stored is trusted.
+# Usage: python verify_ledger.py [ledger file] [workers]
+
+def check_block(block, previous):
+    # Why block is invalid after previous (None for the first block), or None
+    if block.calculate_hash() != block.hash:
+        return "stored hash does not match block content"
+    if previous is not None:
+        if block.index != previous["index"] + 1:
+            return "index does not follow the preceding block"
+        if block.previous_hash != previous["hash"]:
+            return "previous_hash does not match the preceding block"
+    elif block.index == 0 and block.previous_hash != "0":
+        return "genesis block does not start the chain"
+    return None
+
+
+def verify_blocks(blocks):
+    # Verify a run of blocks; the first one is only checked on its own, its
+    # link to the block before is checked when ranges are stitched together.
+    summary = {"count": 0, "first": None, "last": None, "error": None}
+    previous = None
+    for block_data in blocks:
+        if isinstance(block_data, str):
+            summary["error"] = {"index": previous["index"] + 1 if previous else None, "reason": block_data}
+            break
+        try:
+            block = Block(**block_data)
+        except TypeError:
+            summary["error"] = {"index": block_data.get("index"), "reason": "block is missing fields"}
+            break
+        reason = check_block(block, previous)
+        if reason is not None:
+            summary["error"] = {"index": block.index, "reason": reason}
+            break
+        previous = {"index": block.index, "hash": block.hash, "previous_hash": block.previous_hash}
+        if summary["first"] is None:
+            summary["first"] = previous
+        summary["last"] = previous
+        summary["count"] += 1
+    return summary
+
+
+def ledger_blocks(path, start, end):
+    # Blocks of the JSON array that start in [start, end)
+    with open(path, "rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode("ascii")
+    position = 0
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,[":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            return
+        try:
+            block_data, position = _decoder.raw_decode(text, position)
+        except ValueError:
+            yield "block is not valid JSON"
+            return
+        yield block_data
+
+
+def ledger_ranges(path, chunk_bytes):
+    # Cut the indent=4 JSON array just before a top-level block: a line that
+    # is exactly four spaces and "{" (strings never contain raw newlines)
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as file:
+        while start < size:
+            file.seek(min(start + chunk_bytes, size))
+            end = size
+            while True:
+                buffer = file.read(1024 * 1024)
+                found = buffer.find(b"\n    {")
+                if found >= 0:
+                    end = file.tell() - len(buffer) + found + 1
+                    break
+                if file.tell() >= size:
+                    break
+                file.seek(-5, os.SEEK_CUR)  # The marker may straddle two reads
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _verify_range(args):
+    path, start, end = args
+    return verify_blocks(ledger_blocks(path, start, end))
+
+
+def verify_ledger(path, workers=None, chunk_bytes=CHUNK_BYTES):
+    # Returns (block count, None) for a valid ledger, otherwise the first bad
+    # block as (blocks checked before it, {"index": ..., "reason": ...})
+    count = 0
+    previous = None
+    with Pool(workers) as pool:
+        for summary in pool.imap(_verify_range, [(path, start, end) for start, end in ledger_ranges(path, chunk_bytes)]):
+            first = summary["first"]
+            if previous is not None and first is not None:
+                if first["index"] != previous["index"] + 1:
+                    return count, {"index": first["index"], "reason": "index does not follow the preceding block"}
+                if first["previous_hash"] != previous["hash"]:
+                    return count, {"index": first["index"], "reason": "previous_hash does not match the preceding block"}
+            count += summary["count"]
+            if summary["error"] is not None:
+                if summary["error"]["index"] is None and previous is not None:
+                    summary["error"]["index"] = previous["index"] + 1
+                return count, summary["error"]
+            previous = summary["last"] or previous
+    return count, None
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "blockchain_ledger.json"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    started = time.time()
+    count, error = verify_ledger(path, workers)
+    elapsed = time.time() - started
+    if error is None:
+        print(f"{path}: {count} blocks valid ({elapsed:.2f}s)")
+    else:
+        print(f"{path}: first invalid block {error['index']}: {error['reason']} ({count} valid blocks before it, {elapsed:.2f}s)")
+        sys.exit(1)